@@ -1,3 +1,19 @@
-from cullerton.agora.agora import Forum
+# submodules, SQLAlchemy included, are imported on first attribute access
+# so that importing the package is cheap and has no side effects
 
-__all__ = ('Forum')
+from importlib import import_module
+
+submodules = ('agora', 'aio', 'cache', 'counts', 'engine', 'exceptions',
+              'export', 'initialize_db', 'logging', 'metrics', 'models',
+              'query', 'records', 'search', 'session', 'benchmarks')
+
+
+def __getattr__(name):
+    if name == 'Forum':
+        return import_module('cullerton.agora.agora').Forum
+    if name in submodules:
+        return import_module('cullerton.agora.' + name)
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
+
+
+__all__ = ['Forum']
@@ -1,32 +1,283 @@
 from cullerton.agora.logging import logger
-from cullerton.agora.models import Idea, Author
+from cullerton.agora.models import Idea, Author, Base, Tombstone, utcnow
+from cullerton.agora.counts import Counts
+from cullerton.agora.query import _attribute, compile_filters, compile_order
+from cullerton.agora.records import records
+from cullerton.agora.export import write
 from cullerton.agora.exceptions import *
 
+import json
+import os
+
+from contextlib import contextmanager
+
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import datetime, timedelta
+from itertools import islice
+from operator import gt, lt
+from weakref import WeakKeyDictionary, WeakSet
+
+from sqlalchemy import (and_, event, func, insert, inspect, literal, or_,
+                        select)
+from sqlalchemy.exc import DBAPIError, IntegrityError, InvalidRequestError
+from sqlalchemy.orm import (ColumnProperty, Session, joinedload,
+                            scoped_session, selectinload, sessionmaker,
+                            subqueryload)
+from sqlalchemy.orm.util import identity_key
 from sqlalchemy.orm.exc import NoResultFound, MultipleResultsFound
 
 authors_limit = 5
 ideas_limit = 5
+chunk_size = 500
+
+# seconds of the latest changes changes_since leaves for a later call
+changes_lag = 5.0
+
+# seconds a transaction writes ideas before they are stamped again
+# with the time of commit, see _restamp
+restamp_after = 1.0
+
+# how get_ideas and get_authors load related items by default
+ideas_load = 'joined'
+authors_load = 'lazy'
+
+loaders = {'joined': joinedload,
+           'selectin': selectinload,
+           'subquery': subqueryload}
+
+# engines whose schema passed validate_schema
+_valid_engines = WeakKeyDictionary()
+
+# the scoped_sessions of forums, whose sessions a forked child
+# must not use
+_registries = WeakSet()
+
+
+def _after_fork():
+    for registry in list(_registries):
+        registry.clear()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork)
+
+
+def _encode_cursor(key, value, id):
+    """return an opaque token for the row at (value, id) ordered by key"""
+    if isinstance(value, datetime):
+        value = {'datetime': value.isoformat()}
+    token = json.dumps([key, value, id], separators=(',', ':'))
+    return urlsafe_b64encode(token.encode('utf-8')).decode('ascii')
+
+
+def _decode_cursor(cursor, key):
+    """return (value, id) from a token made by _encode_cursor for key"""
+    try:
+        (token_key, value, id) = json.loads(
+            urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+        if isinstance(value, dict):
+            value = datetime.fromisoformat(value['datetime'])
+    except Exception:
+        raise InvalidCursor
+    if token_key != key or not isinstance(id, int):
+        raise InvalidCursor
+    return (value, id)
+
+
+def _unique_violation(error):
+    """return whether the IntegrityError error broke a unique constraint,
+       rather than, say, a NOT NULL or foreign key constraint"""
+    orig = error.orig
+    # the SQLSTATE, from psycopg2 and asyncpg
+    code = getattr(orig, 'pgcode', None) or getattr(orig, 'sqlstate', None)
+    if code:
+        return code == '23505'
+    # SQLite says UNIQUE constraint failed, MySQL Duplicate entry
+    message = str(orig).lower()
+    return 'unique' in message or 'duplicate' in message
+
+
+def _encode_watermark(positions):
+    """return an opaque token for positions, (datetime, id) or None each"""
+    token = json.dumps([position and [position[0].isoformat(), position[1]]
+                        for position in positions], separators=(',', ':'))
+    return urlsafe_b64encode(token.encode('utf-8')).decode('ascii')
+
+
+def _decode_watermark(token, count):
+    """return count positions from a token made by _encode_watermark"""
+    try:
+        positions = [position and (datetime.fromisoformat(position[0]),
+                                   int(position[1]))
+                     for position in json.loads(urlsafe_b64decode(
+                         token.encode('ascii')).decode('utf-8'))]
+    except Exception:
+        raise InvalidCursor
+    if len(positions) != count:
+        raise InvalidCursor
+    return positions
+
+
+def _after(column, id_column, position):
+    """return criteria for the rows after position, (value, id),
+       in the order of column then id_column"""
+    (value, id) = position
+    return or_(column > value, and_(column == value, id_column > id))
+
+
+def validate_schema(engine, cache=True):
+    """raise InvalidSession unless the database of engine has the tables,
+       columns, and indexes declared in models
+            a valid engine is remembered, and not checked again when cache"""
+    engine = engine.engine
+    if cache and engine in _valid_engines:
+        return
+    inspector = inspect(engine)
+    table_names = set(inspector.get_table_names())
+    for table in Base.metadata.sorted_tables:
+        if table.name not in table_names:
+            raise InvalidSession("missing table %s" % table.name)
+        columns = set(column['name']
+                      for column in inspector.get_columns(table.name))
+        missing = set(column.name for column in table.columns) - columns
+        if missing:
+            raise InvalidSession("missing columns %s.%s" % (
+                table.name, ', '.join(sorted(missing))))
+        indexes = set(index['name']
+                      for index in inspector.get_indexes(table.name))
+        missing = set(index.name for index in table.indexes) - indexes
+        if missing:
+            raise InvalidSession("missing indexes %s" % (
+                ', '.join(sorted(missing))))
+    _valid_engines[engine] = True
+
+
+@event.listens_for(Session, 'after_flush')
+def _after_flush(session, flush_context):
+    session.info['agora_written'] = True
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def _do_orm_execute(state):
+    if state.is_insert or state.is_update or state.is_delete:
+        state.session.info['agora_written'] = True
+
+
+@event.listens_for(Session, 'after_transaction_end')
+def _after_transaction_end(session, transaction):
+    if transaction.parent is None:
+        session.info.pop('agora_written', None)
+        session.info.pop('agora_stamp', None)
+        session.info.pop('agora_stamped', None)
+
+
+def _has_written(session):
+    """return whether the open transaction of session has written,
+       or has changes waiting to be flushed"""
+    return bool(session.info.get('agora_written') or session.new or
+                session.dirty or session.deleted)
+
+
+def _stamp(session, table):
+    """return the stamp of the open transaction of session, for the
+       modified time of ideas, or the created time of tombstones, in table
+           _restamp replaces it with the time of commit"""
+    session.info.setdefault('agora_stamped', set()).add(table)
+    if 'agora_stamp' not in session.info:
+        session.info['agora_stamp'] = utcnow()
+    return session.info['agora_stamp']
+
+
+def _restamp(session):
+    """stamp the rows written with the stamp of the open transaction
+       of session with the time now, right before it commits
+           so changes_since reads changes in about the order they commit,
+           however long the transaction took
+           a transaction that began writing less than restamp_after
+           seconds ago keeps its stamp, to save the UPDATE"""
+    session.flush()
+    stamp = session.info.get('agora_stamp')
+    stamped = session.info.get('agora_stamped', ())
+    now = utcnow()
+    if stamp is None or now - stamp < timedelta(seconds=restamp_after):
+        return
+    if Idea in stamped:
+        session.query(Idea).filter(Idea.modified == stamp).update(
+            {'modified': now}, synchronize_session='evaluate')
+    if Tombstone in stamped:
+        session.query(Tombstone).filter(Tombstone.created == stamp).update(
+            {'created': now}, synchronize_session=False)
+
+
+@event.listens_for(Session, 'before_flush')
+def _before_flush(session, flush_context, instances):
+    # ideas added or edited in a forum transaction get its stamp
+    if not session.info.get('agora_scopes'):
+        return
+    for item in list(session.new) + list(session.dirty):
+        if isinstance(item, Idea) and session.is_modified(item) and \
+                not inspect(item).attrs.modified.history.has_changes():
+            item.modified = _stamp(session, Idea)
 
 
 class AgoraBase():
 
     def _validate_session(self):
-        engine = self.session.get_bind()
-        table_names = engine.table_names()
-        try:
-            assert 'ideas' in table_names and 'authors' in table_names
-        except:
-            raise InvalidSession
+        validate_schema(self.session.get_bind())
+
+    def _scopes(self):
+        """return the stack of open transaction scopes on the session
+           each scope is a list of (function, args) to call after commit
+           the stack lives on the session, so forums sharing a session,
+           or a scoped_session in one thread, share their transactions"""
+        return self.session.info.setdefault('agora_scopes', [])
 
-    def _session_query(self, table, filters={}, limit=None, order=None):
+    def _after_commit(self, function, *args):
+        """call function(*args) once the open transaction commits
+           right away when there is none
+           forgotten if the transaction rolls back"""
+        scopes = self._scopes()
+        if scopes:
+            scopes[-1].append((function, args))
+        else:
+            function(*args)
+
+    def _session_query(self, table, filters={}, limit=None, order=None,
+                       load='lazy'):
         """return result of query
+                filters and order are described in query.py
            """
         return self.session.query(
-            table).filter_by(**filters).order_by(order).limit(limit)
+            table).options(*self._load_options(table, load)).filter(
+            *compile_filters(table, filters)).order_by(
+            *compile_order(table, order)).limit(limit)
+
+    def _load_options(self, table, load):
+        """return query options loading the related items of table
+                load is 'lazy', 'joined', 'selectin', or 'subquery'"""
+        if load == 'lazy':
+            return []
+        try:
+            loader = loaders[load]
+        except KeyError:
+            raise ValueError("unknown load strategy: %s" % load)
+        related = Idea.author if table is Idea else Author.ideas
+        return [loader(related)]
 
-    def _get_item_count(self, table):
+    def _get_item_count(self, table, filters={}):
         """return count of items in table"""
-        return self._session_query(table).count()
+        # query.count() would wrap the query in a subquery
+        return self.session.query(
+            func.count(table.id)).filter(
+            *compile_filters(table, filters)).scalar()
+
+    def _get_count(self, table):
+        """return count of items in table, from counts when we have it"""
+        count = self.counts.get(table.__tablename__)
+        if count is None:
+            count = self._get_item_count(table)
+            self._after_commit(self.counts.set, table.__tablename__, count)
+        return count
 
     def _get_item(self, table, id):
         """return item identified by table and id"""
@@ -39,61 +290,315 @@ class AgoraBase():
             raise
         return item
 
-    def _get_items(self, table, filters={}, limit=None, order=None):
+    def _get_items_by_ids(self, table, ids, load='lazy', chunk_size=None):
+        """return a list of items from table in the order of ids
+                None for each id without an item
+                items already loaded in the session are not read again
+                the rest are read chunk_size ids at a time"""
+        ids = list(ids)
+        items = {}
+        missing = []
+        for id in set(ids):
+            item = self.session.identity_map.get(identity_key(table, id))
+            if item is not None and not inspect(item).expired_attributes:
+                items[id] = item
+            else:
+                missing.append(id)
+
+        chunk_size = chunk_size or self.chunk_size
+        for start in range(0, len(missing), chunk_size):
+            filters = {'id__in': missing[start:start + chunk_size]}
+            for item in self._session_query(table, filters=filters,
+                                            load=load):
+                items[item.id] = item
+        return [items.get(id) for id in ids]
+
+    def _get_item_dict(self, table, id):
+        """return to_dict() of item identified by table and id
+           read through the cache when the forum has one"""
+        key = (table.__tablename__, id)
+        if self.cache is not None:
+            value = self.cache.get(key)
+            if value is not None:
+                return value
+        item = self._get_item(table, id)
+        if item is None:
+            return None
+        value = item.to_dict()
+        if self.cache is not None:
+            # what we read inside a transaction may yet roll back
+            self._after_commit(self.cache.set, key, value)
+        return value
+
+    def _invalidate(self, table, ids):
+        """drop items identified by table and ids from the cache"""
+        if self.cache is not None:
+            for id in ids:
+                self.cache.delete((table.__tablename__, id))
+
+    def _invalidate_all(self):
+        """drop everything from the cache"""
+        if self.cache is not None:
+            self.cache.clear()
+
+    def _get_items(self, table, filters={}, limit=None, order=None,
+                   load='lazy'):
         """return a list of items from table"""
         items = []
         result = self._session_query(
-            table, filters=filters, limit=limit, order=order)
+            table, filters=filters, limit=limit, order=order, load=load)
         for row in result:
             items.append(row)
         return items
 
-    def _add_item(self, table, filters, **kwargs):
+    def _iter_items(self, table, filters={}, limit=None, order=None,
+                    batch_size=None, load='lazy'):
+        """yield items from table, fetching batch_size rows at a time
+           each item is expunged from the session once the caller moves on
+                'subquery', and 'joined' for author ideas, load as
+                'selectin', since yield_per cannot use them"""
+        if load == 'subquery' or (load == 'joined' and table is Author):
+            load = 'selectin'
+        result = self._session_query(
+            table, filters=filters, limit=limit, order=order,
+            load=load).execution_options(stream_results=True).yield_per(
+            batch_size or self.chunk_size)
+        for item in result:
+            yield item
+            self.session.expunge(item)
+
+    def _record_query(self, table, filters={}, limit=None, order=None):
+        """return a query of the record columns of table
+           ideas are joined to their authors"""
+        query = self.session.query(*records[table].columns)
+        if table is Idea:
+            query = query.join(Idea.author)
+        return query.filter(
+            *compile_filters(table, filters)).order_by(
+            *compile_order(table, order)).limit(limit)
+
+    def _get_records(self, table, filters={}, limit=None, order=None):
+        """return a list of records from table"""
+        record = records[table]
+        result = self.session.execute(self._record_query(
+            table, filters=filters, limit=limit, order=order).statement)
+        return [record(*row) for row in result]
+
+    def _iter_rows(self, table, filters={}, limit=None, order=None,
+                   batch_size=None):
+        """yield tuples of the record columns of table
+           fetching batch_size rows at a time"""
+        result = self.session.execute(
+            self._record_query(
+                table, filters=filters, limit=limit, order=order).statement,
+            execution_options={'stream_results': True})
+        for rows in result.partitions(batch_size or self.chunk_size):
+            for row in rows:
+                yield row
+
+    def _iter_records(self, table, filters={}, limit=None, order=None,
+                      batch_size=None):
+        """yield records from table, fetching batch_size rows at a time"""
+        record = records[table]
+        for row in self._iter_rows(table, filters=filters, limit=limit,
+                                   order=order, batch_size=batch_size):
+            yield record(*row)
+
+    def _export(self, table, file, format='jsonl', filters={}, limit=None,
+                order='id', batch_size=None):
+        """write rows of table to file, see export.write
+           return the number of rows written"""
+        return write(file, records[table].fields, self._iter_rows(
+            table, filters=filters, limit=limit, order=order,
+            batch_size=batch_size), format=format)
+
+    def _get_page(self, table, filters={}, limit=None, cursor=None,
+                  order='id', load='lazy'):
+        """return a page of items from table and a token for the next page
+                order is a column name, prefixed with '-' for descending
+                NULLs come last, or first when descending
+                rows are read after (order, id) of the row in cursor
+           the token is None when there are no more items"""
+        key = order.lstrip('-')
+        descending = order.startswith('-')
+        column = _attribute(table, key)
+        if not isinstance(column.property, ColumnProperty):
+            raise InvalidFilter(key)
+        nullable = key != 'id' and column.property.columns[0].nullable
+        columns = [column, table.id] if key != 'id' else [table.id]
+        if nullable:
+            # NULLs sort first on some databases and last on others
+            columns.insert(0, column.is_(None))
+
+        query = self.session.query(table).options(
+            *self._load_options(table, load)).filter(
+            *compile_filters(table, filters))
+        if cursor:
+            (value, id) = _decode_cursor(cursor, key)
+            compare = lt if descending else gt
+            after = compare(table.id, id)
+            if key != 'id' and value is None:
+                after = and_(column.is_(None), after)
+                if descending:
+                    after = or_(column.isnot(None), after)
+            elif key != 'id':
+                value = literal(value, column.type)
+                after = or_(compare(column, value),
+                            and_(column == value, after))
+                if nullable and not descending:
+                    after = or_(after, column.is_(None))
+            query = query.filter(after)
+        if descending:
+            columns = [column.desc() for column in columns]
+
+        items = query.order_by(*columns).limit(limit + 1).all()
+        if len(items) <= limit:
+            return (items, None)
+        items = items[:limit]
+        last = items[-1]
+        return (items, _encode_cursor(key, getattr(last, key), last.id))
+
+    def _add_item(self, table, **kwargs):
         """add an item to table with values in kwargs
-                retreive new item with filters
+                a unique constraint violation raises DuplicateItem,
+                other constraint violations AddItem
            return new item id"""
 
         new_item = table(**kwargs)
         self.session.add(new_item)
-        self.session.commit()
 
-        # try to get our new item
+        # the flush assigns the primary key of our new item
+        # the caller's transaction rolls back on errors
         try:
-            item = self._session_query(table, filters).one()
-        except NoResultFound:
-            raise AddItem('No Result Found')
-        return item.id
+            self.session.flush()
+        except IntegrityError as e:
+            logger.info("_add_item: IntegrityError: %s" % str(e))
+            if _unique_violation(e):
+                raise DuplicateItem(str(e))
+            raise AddItem(str(e))
+        except DBAPIError:
+            # such as a locked database, which callers may retry
+            raise
+        except Exception as e:
+            logger.info("_add_item: Exception: %s" % str(e))
+            raise AddItem(str(e))
+        return new_item.id
 
-    def _delete_item(self, table, id):
-        """return item from table"""
-        # see if we have item
-        filters = {'id': id}
-        try:
-            self._session_query(table, filters).one()
-        except NoResultFound:
-            raise InvalidItem
-        else:
-            # try to delete item
-            try:
-                # we cannot call .delete() on _session_query because order_by
-                self.session.query(table).filter_by(id=id).delete()
-            except Exception as e:
-                logger.info("_delete_item: Exception: %s" % str(e))
+    def _get_existing_keys(self, table, keys, values):
+        """return the set of key tuples in values already in table"""
+        columns = [getattr(table, key) for key in keys]
+        query = self.session.query(*columns)
+        for (index, column) in enumerate(columns):
+            query = query.filter(
+                column.in_(set(value[index] for value in values)))
+        return set(tuple(row) for row in query) & set(values)
+
+    def _add_chunk(self, table, keys, rows):
+        """insert rows with a single executemany
+           skip rows whose keys are already in table
+           return a list of new item ids in row order, None for duplicates"""
+        row_keys = [tuple(row[key] for key in keys) for row in rows]
+        existing = self._get_existing_keys(table, keys, row_keys)
+
+        new_rows = []
+        new_keys = []
+        for (row, key) in zip(rows, row_keys):
+            if key in existing:
+                new_keys.append(None)
             else:
-                self.session.commit()
+                existing.add(key)
+                new_rows.append(row)
+                new_keys.append(key)
+
+        new_ids = {}
+        if new_rows:
+            self.session.bulk_insert_mappings(table, new_rows)
+            columns = [getattr(table, key) for key in keys]
+            new_ids = dict(
+                (tuple(row[1:]), row[0]) for row in
+                self.session.query(table.id, *columns).filter(
+                    *[column.in_(set(key[index] for key in new_keys if key))
+                      for (index, column) in enumerate(columns)]))
+        return [new_ids.get(key) for key in new_keys]
+
+    def _add_items(self, table, keys, rows, chunk_size=None,
+                   validate=None):
+        """add rows to table
+                rows is an iterable of dicts of column values
+                duplicates are detected on keys, one query per chunk
+                validate is called with each chunk before it is inserted
+           return a list of new item ids in input order, None for duplicates"""
+        chunk_size = chunk_size or self.chunk_size
+        rows = iter(rows)
+        ids = []
+        chunk = list(islice(rows, chunk_size))
+        while chunk:
+            if validate:
+                validate(chunk)
+            ids.extend(self._add_chunk(table, keys, chunk))
+            chunk = list(islice(rows, chunk_size))
+        return ids
 
-        # see if the delete worked
+    def _add_tombstones(self, criteria, authors=False):
+        """add a Tombstone for each idea matching criteria,
+           before the ideas are deleted
+           return the author_id of each idea when authors, else None"""
+        stamp = _stamp(self.session, Tombstone)
+        tombstones = insert(Tombstone).from_select(
+            ['idea_id', 'author_id', 'created'],
+            select(Idea.id, Idea.author_id,
+                   literal(stamp, Tombstone.created.type)).where(*criteria))
         try:
-            self._session_query(table, filters).one()
-        except NoResultFound:
-            # delete worked
-            return id
-        else:
-            # idea is still in the database, so delete failed
-            raise DeleteItem
+            if not authors:
+                # one INSERT ... SELECT
+                self.session.execute(tombstones)
+                return None
+            if self.session.get_bind().dialect.full_returning:
+                return [row.author_id for row in self.session.execute(
+                    tombstones.returning(Tombstone.author_id))]
+            rows = self.session.query(Idea.id, Idea.author_id).filter(
+                *criteria).all()
+            if rows:
+                self.session.execute(insert(Tombstone), [
+                    {'idea_id': row.id, 'author_id': row.author_id,
+                     'created': stamp} for row in rows])
+            return [row.author_id for row in rows]
+        except DBAPIError:
+            # such as a locked database, which callers may retry
+            raise
+        except Exception as e:
+            logger.info("_add_tombstones: Exception: %s" % str(e))
+            raise DeleteItem(str(e))
+
+    def _delete_items(self, table, filters, tombstones=True):
+        """delete the items in table matching filters
+                deleted ideas leave a Tombstone for changes_since,
+                unless the caller added them, see _add_tombstones
+           return number of items deleted"""
+        criteria = compile_filters(table, filters)
+        if table is Idea and tombstones:
+            self._add_tombstones(criteria)
+        try:
+            # we cannot call .delete() on _session_query because order_by
+            return self.session.query(table).filter(*criteria).delete()
+        except DBAPIError:
+            # such as a locked database, which callers may retry
+            raise
+        except Exception as e:
+            logger.info("_delete_items: Exception: %s" % str(e))
+            raise DeleteItem(str(e))
+
+    def _delete_item(self, table, id):
+        """delete item identified by table and id
+           return id"""
+        # the rowcount tells us whether we had the item
+        if not self._delete_items(table, {'id': id}):
+            raise InvalidItem
+        return id
 
     def _edit_item(self, table, id, **kwargs):
-        """edit an item"""
+        """edit an item
+           return id"""
         filters = {'id': id}
         try:
             item = self._session_query(table, filters=filters).one()
@@ -106,90 +611,352 @@ class AgoraBase():
                         setattr(item, key, value)
                     except:
                         raise EditItem
-        return_item = self._session_query(table, filters=filters).one()
-        return return_item.id
+        try:
+            self.session.flush()
+        except IntegrityError as e:
+            logger.info("_edit_item: IntegrityError: %s" % str(e))
+            raise EditItem(str(e))
+        except DBAPIError:
+            # such as a locked database, which callers may retry
+            raise
+        except Exception as e:
+            logger.info("_edit_item: Exception: %s" % str(e))
+            raise EditItem(str(e))
+        return id
+
+    def _chunk_criteria(self, table, filters=None, ids=None):
+        """return lists of criteria for the items of table
+           matching filters and ids, one list for every chunk_size ids"""
+        criteria = compile_filters(table, filters or {})
+        if ids is None:
+            return [criteria]
+        ids = list(ids)
+        return [criteria + [table.id.in_(ids[start:start + self.chunk_size])]
+                for start in range(0, len(ids), self.chunk_size)]
+
+    def _get_ids(self, table, filters=None, ids=None):
+        """return the ids of the items in table matching filters and ids"""
+        return [row.id for criteria in self._chunk_criteria(
+                table, filters=filters, ids=ids) for row in
+                self.session.query(table.id).filter(*criteria)]
+
+    def _edit_items(self, table, values, filters=None, ids=None):
+        """set the columns in values for the items in table
+           matching filters and ids, without loading them
+                one UPDATE, or one for every chunk_size ids
+                items already loaded in the session are updated to match
+           return the number of items updated"""
+        if filters is None and ids is None:
+            raise EditItem("filters or ids are required")
+        columns = table.__mapper__.column_attrs
+        for key in values:
+            if key == 'id' or key not in columns:
+                raise EditItem("unknown column: %s" % key)
+
+        count = 0
+        for criteria in self._chunk_criteria(table, filters=filters, ids=ids):
+            query = self.session.query(table).filter(*criteria)
+            try:
+                try:
+                    count += query.update(
+                        values, synchronize_session='evaluate')
+                except InvalidRequestError:
+                    # criteria we cannot test in Python, such as startswith
+                    count += query.update(values, synchronize_session='fetch')
+            except IntegrityError as e:
+                logger.info("_edit_items: IntegrityError: %s" % str(e))
+                raise EditItem(str(e))
+            except DBAPIError:
+                # such as a locked database, which callers may retry
+                raise
+            except Exception as e:
+                logger.info("_edit_items: Exception: %s" % str(e))
+                raise EditItem(str(e))
+        return count
 
 
 class Forum(AgoraBase):
 
     """a forum for ideas"""
 
-    def __init__(self, session):
-        """add the SQLAlchemy database session"""
+    def __init__(self, session, cache=None, counts=None, search_index=None,
+                 metrics=None, validate=True):
+        """add the SQLAlchemy database session
+                a sessionmaker gives each thread a session of its own
+                so does a scoped_session, a single Session does not
+           an optional cache.CacheBackend for get_*_dict
+           optional counts.Counts to share between forums
+           an optional search.SearchIndex for search_ideas
+           and optional metrics.Metrics to record method calls and SQL
+                validate checks the schema, once for each engine,
+                see validate_schema"""
+        if isinstance(session, sessionmaker):
+            session = scoped_session(session)
+        if isinstance(session, scoped_session):
+            _registries.add(session.registry)
         self.session = session
+        self.cache = cache
+        self.search_index = search_index
+        self.counts = counts if counts is not None else Counts()
         self.authors_limit = authors_limit
         self.ideas_limit = ideas_limit
-        self._validate_session()
+        self.chunk_size = chunk_size
+        self.changes_lag = changes_lag
+        self.authors_load = authors_load
+        self.ideas_load = ideas_load
+        self.metrics = metrics
+        if validate:
+            self._validate_session()
+        if metrics is not None:
+            metrics.instrument(self)
+
+    #
+    # Transactions
+    #
+
+    @contextmanager
+    def transaction(self):
+        """run the forum calls in the with block in one transaction
+           commit once on exit, or roll back if the block raises
+           ids are handed out as each call flushes
+           a transaction inside another runs in a savepoint,
+           so it can roll back on its own
+
+                with forum.transaction():
+                    author_id = forum.add_author(...)
+                    forum.add_idea(title, idea, author_id)
+
+           the cache, counts, and search index are updated after commit
+           every write method runs in a transaction of its own,
+           so outside a with block each write commits by itself"""
+        scopes = self._scopes()
+        scope = []
+        if scopes:
+            savepoint = self.session.begin_nested()
+            scopes.append(scope)
+            try:
+                yield self
+                savepoint.commit()
+            except BaseException:
+                savepoint.rollback()
+                raise
+            finally:
+                scopes.pop()
+            # the outer transaction may still roll back
+            scopes[-1].extend(scope)
+        else:
+            session = self.session() if isinstance(
+                self.session, scoped_session) else self.session
+            if session.in_transaction() and not _has_written(session):
+                # a transaction that has only read, such as the autobegun
+                # transaction of an earlier get_ideas, would have to
+                # upgrade to write, which SQLite does not wait for
+                session.commit()
+            if not session.in_transaction():
+                # begin on the primary, ready to write
+                session.connection(execution_options={'agora_write': True})
+            scopes.append(scope)
+            try:
+                yield self
+                _restamp(session)
+                self.session.commit()
+            except BaseException:
+                self.session.rollback()
+                raise
+            finally:
+                scopes.pop()
+            for (function, args) in scope:
+                function(*args)
 
     #
     # Authors
     #
 
     def get_author_count(self):
-        return self._get_item_count(Author)
+        """return a count of authors"""
+        return self._get_count(Author)
+
+    def get_author_idea_count(self, id):
+        """return a count of the ideas for an author"""
+        count = self.counts.get_author(id)
+        if count is None:
+            count = self._get_item_count(Idea, filters={'author_id': id})
+            self._after_commit(self.counts.set_author, id, count)
+        return count
 
     def get_author(self, id):
         """return the requested author"""
         return self._get_item(Author, id)
 
-    def get_authors(self, filters={}, limit=None, order=None):
+    def get_authors_by_ids(self, ids, load=None):
+        """return the requested authors in the order of ids
+           None for each id without an author"""
+        return self._get_items_by_ids(Author, ids,
+                                      load=load or self.authors_load)
+
+    def get_author_dict(self, id):
+        """return the requested author as a dict, through the cache"""
+        return self._get_item_dict(Author, id)
+
+    def get_authors(self, filters={}, limit=None, order=None, load=None):
         """return a list of authors
-           with optional filters, limit, and order"""
+           with optional filters, limit, and order
+                load is how to load author ideas, see _load_options"""
         return self._get_items(
+            Author, filters=filters, limit=limit, order=order,
+            load=load or self.authors_load)
+
+    def iter_authors(self, filters={}, limit=None, order=None,
+                     batch_size=None, load=None):
+        """yield authors, streaming them in batches of batch_size
+           with optional filters, limit, and order"""
+        return self._iter_items(Author, filters=filters, limit=limit,
+                                order=order, batch_size=batch_size,
+                                load=load or self.authors_load)
+
+    def get_authors_page(self, filters={}, limit=None, cursor=None,
+                         order='id', load=None):
+        """return a page of authors and a cursor for the next page
+           with optional filters, limit, and order
+                order is a column name, prefixed with '-' for descending"""
+        return self._get_page(
+            Author, filters=filters, limit=limit or self.authors_limit,
+            cursor=cursor, order=order, load=load or self.authors_load)
+
+    def get_author_records(self, filters={}, limit=None, order=None):
+        """return a list of records.AuthorRecord
+           with optional filters, limit, and order
+           records are read-only and not tracked by the session"""
+        return self._get_records(
             Author, filters=filters, limit=limit, order=order)
 
+    def iter_author_records(self, filters={}, limit=None, order=None,
+                            batch_size=None):
+        """yield records.AuthorRecord, streaming them in batches
+           with optional filters, limit, and order"""
+        return self._iter_records(Author, filters=filters, limit=limit,
+                                  order=order, batch_size=batch_size)
+
+    def export_authors(self, file, format='jsonl', filters={}, limit=None,
+                       order='id', batch_size=None):
+        """write authors to the text file file, a row at a time
+           with optional filters, limit, and order
+                format is 'jsonl' or 'csv'
+           return the number of authors written"""
+        return self._export(Author, file, format=format, filters=filters,
+                            limit=limit, order=order, batch_size=batch_size)
+
     def add_author(self, username, fullname, email):
         if username:
-            filters = {'username': username}
             kwargs = {'username': username, 'fullname': fullname, 'email': email}
 
-            # check whether the author already exists
-            if len(self._get_items(Author, filters=filters)) > 0:
-                raise DuplicateAuthor
-
-            # the author does not already exist, attempt to add the author
-            try:
-                new_author_id = self._add_item(Author, filters, **kwargs)
-            except AddItem:
-                raise AddAuthor
+            # the unique username tells us whether the author already exists
+            with self.transaction():
+                try:
+                    new_author_id = self._add_item(Author, **kwargs)
+                except DuplicateItem:
+                    raise DuplicateAuthor
+                except AddItem:
+                    raise AddAuthor
 
+                self._after_commit(self._invalidate, Author, [new_author_id])
+                self._after_commit(self.counts.add, 'authors', 1)
+                self._after_commit(self.counts.set_author, new_author_id, 0)
             return new_author_id
         else:
             raise AddAuthor
 
+    def add_authors(self, authors, chunk_size=None):
+        """add many authors in a single transaction
+                authors is an iterable of dicts with
+                username, fullname, and email
+           return a list of new author ids in input order
+                None marks an author whose username already exists"""
+
+        def validate(chunk):
+            for author in chunk:
+                if not author.get('username'):
+                    raise AddAuthor
+
+        rows = ({'username': author.get('username'),
+                 'fullname': author.get('fullname'),
+                 'email': author.get('email')} for author in authors)
+        with self.transaction():
+            ids = self._add_items(Author, ('username',), rows,
+                                  chunk_size=chunk_size, validate=validate)
+            new_ids = [id for id in ids if id is not None]
+            self._after_commit(self._invalidate, Author, new_ids)
+            self._after_commit(self.counts.add, 'authors', len(new_ids))
+            for id in new_ids:
+                self._after_commit(self.counts.set_author, id, 0)
+        return ids
+
     def edit_author(self, id, **kwargs):
         """edit an author already in the database"""
-        try:
-            self._edit_item(Author, id, **kwargs)
-        except (NoResultFound, MultipleResultsFound):
-            raise
-        except EditItem:
-            raise EditAuthor
-        else:
-            return id
+        with self.transaction():
+            try:
+                self._edit_item(Author, id, **kwargs)
+            except (NoResultFound, MultipleResultsFound):
+                raise
+            except EditItem:
+                raise EditAuthor
+            # idea dicts include the author, so they go stale too
+            self._after_commit(self._invalidate_all)
+        return id
+
+    def edit_authors(self, values, filters=None, ids=None):
+        """edit the authors matching filters, with ids, or both
+           without loading them
+                values is a dict of column names and new values
+                filters={} edits every author
+           return the number of authors edited"""
+        with self.transaction():
+            try:
+                count = self._edit_items(
+                    Author, values, filters=filters, ids=ids)
+            except EditItem:
+                raise EditAuthor
+            # idea dicts include the author, so they go stale too
+            self._after_commit(self._invalidate_all)
+        return count
 
     def delete_author(self, id):
-        """delete an author
-           delete all the author ideas first"""
+        """delete an author and all the author ideas in one transaction"""
 
-        if self.get_author(id):
-            self.delete_author_ideas(id)
+        with self.transaction():
             try:
-                self._delete_item(Author, id)
+                count = self._delete_items(Idea, {'author_id': id})
+                if not self._delete_items(Author, {'id': id}):
+                    raise InvalidAuthor
             except DeleteItem:
                 raise DeleteAuthor
-        else:
-                raise InvalidAuthor
+            self._after_commit(self._invalidate_all)
+            if self.search_index is not None:
+                self._after_commit(
+                    self.search_index.remove_author, self.session, id)
+            self._after_commit(self.counts.add, 'authors', -1)
+            self._after_commit(self.counts.add, 'ideas', -count)
+            self._after_commit(self.counts.discard_author, id)
+        logger.info("delete_author: deleted author %s and %s ideas"
+                    % (id, count))
         return id
 
     def delete_author_ideas(self, id):
-        """delete all the ideas for an author"""
+        """delete all the ideas for an author
+           return number of ideas deleted"""
 
-        if self.get_author(id):
-            filters = {'author': self.get_author(id)}
-            ideas = self.get_ideas(filters=filters)
-            for idea in ideas:
-                self.delete_idea(idea.id)
+        with self.transaction():
+            try:
+                count = self._delete_items(Idea, {'author_id': id})
+            except DeleteItem:
+                raise DeleteIdea
+            self._after_commit(self._invalidate_all)
+            if self.search_index is not None:
+                self._after_commit(
+                    self.search_index.remove_author, self.session, id)
+            self._after_commit(self.counts.add, 'ideas', -count)
+            self._after_commit(self.counts.add_author, id, -count)
+        return count
 
     #
     # Ideas
@@ -197,15 +964,67 @@ class Forum(AgoraBase):
 
     def get_idea_count(self):
         """return a count of ideas"""
-        return self._get_item_count(Idea)
+        return self._get_count(Idea)
 
     def get_idea(self, id):
         """return the requested idea"""
         return self._get_item(Idea, id)
 
-    def get_ideas(self, filters={}, limit=None, order=None):
-        """return a list of ideas"""
-        return self._get_items(Idea, filters=filters, limit=limit, order=order)
+    def get_ideas_by_ids(self, ids, load=None):
+        """return the requested ideas in the order of ids
+           None for each id without an idea"""
+        return self._get_items_by_ids(Idea, ids, load=load or self.ideas_load)
+
+    def get_idea_dict(self, id):
+        """return the requested idea as a dict, through the cache"""
+        return self._get_item_dict(Idea, id)
+
+    def get_ideas(self, filters={}, limit=None, order=None, load=None):
+        """return a list of ideas
+                load is how to load idea authors, see _load_options"""
+        return self._get_items(Idea, filters=filters, limit=limit, order=order,
+                               load=load or self.ideas_load)
+
+    def iter_ideas(self, filters={}, limit=None, order=None, batch_size=None,
+                   load=None):
+        """yield ideas, streaming them in batches of batch_size
+           with optional filters, limit, and order"""
+        return self._iter_items(Idea, filters=filters, limit=limit,
+                                order=order, batch_size=batch_size,
+                                load=load or self.ideas_load)
+
+    def get_ideas_page(self, filters={}, limit=None, cursor=None,
+                       order='id', load=None):
+        """return a page of ideas and a cursor for the next page
+           with optional filters, limit, and order
+                order is a column name, prefixed with '-' for descending"""
+        return self._get_page(
+            Idea, filters=filters, limit=limit or self.ideas_limit,
+            cursor=cursor, order=order, load=load or self.ideas_load)
+
+    def get_idea_records(self, filters={}, limit=None, order=None):
+        """return a list of records.IdeaRecord
+           with the username and fullname of each author
+           records are read-only and not tracked by the session"""
+        return self._get_records(
+            Idea, filters=filters, limit=limit, order=order)
+
+    def iter_idea_records(self, filters={}, limit=None, order=None,
+                          batch_size=None):
+        """yield records.IdeaRecord, streaming them in batches
+           with optional filters, limit, and order"""
+        return self._iter_records(Idea, filters=filters, limit=limit,
+                                  order=order, batch_size=batch_size)
+
+    def export_ideas(self, file, format='jsonl', filters={}, limit=None,
+                     order='id', batch_size=None):
+        """write ideas, with the username and fullname of each author,
+           to the text file file, a row at a time
+           with optional filters, limit, and order
+                format is 'jsonl' or 'csv'
+           return the number of ideas written"""
+        return self._export(Idea, file, format=format, filters=filters,
+                            limit=limit, order=order, batch_size=batch_size)
 
     def add_idea(self, title, idea, author_id):
         """add an idea to the database
@@ -213,43 +1032,254 @@ class Forum(AgoraBase):
 
         if title:
 
-            author = self.get_author(author_id)
-            filters = {'author': author, 'title': title}
-            kwargs = {'title': title, 'idea': idea, 'author': author}
+            # the author is read in the transaction that writes,
+            # so it cannot be deleted before the idea is added
+            with self.transaction():
+                author = self.get_author(author_id)
+                if author is None:
+                    raise AddIdea
+                kwargs = {'title': title, 'idea': idea, 'author': author}
 
-            # check whether the idea already exists
-            if len(self._get_items(Idea, filters=filters)) > 0:
-                raise DuplicateIdea
-
-            # add the idea
-            new_idea_id = self._add_item(Idea, filters, **kwargs)
+                # the unique title tells us whether the idea already exists
+                try:
+                    new_idea_id = self._add_item(Idea, **kwargs)
+                except DuplicateItem:
+                    raise DuplicateIdea
+                except AddItem:
+                    raise AddIdea
+                self._after_commit(self._invalidate, Idea, [new_idea_id])
+                if self.search_index is not None:
+                    self._after_commit(self.search_index.add, self.session, [
+                        {'id': new_idea_id, 'author_id': author_id,
+                         'title': title, 'idea': idea}])
+                self._after_commit(self.counts.add, 'ideas', 1)
+                self._after_commit(self.counts.add_author, author_id, 1)
             # return the id
             return new_idea_id
 
         else:
             raise AddIdea
 
+    def add_ideas(self, ideas, chunk_size=None):
+        """add many ideas in a single transaction
+                ideas is an iterable of dicts with title, idea, and author_id
+           return a list of new idea ids in input order
+                None marks an idea whose title the author already used"""
+
+        def validate(chunk):
+            author_ids = set(idea['author_id'] for idea in chunk)
+            found = set(row.id for row in self.session.query(Author.id).filter(
+                Author.id.in_(author_ids)))
+            for idea in chunk:
+                if not idea['title']:
+                    raise AddIdea
+                if idea['author_id'] not in found:
+                    raise InvalidAuthor
+
+        # remember the author of each row to update their idea counts
+        # and the rows themselves for the search index
+        author_ids = []
+        indexed = []
+
+        def rows():
+            for idea in ideas:
+                row = {'title': idea.get('title'),
+                       'idea': idea.get('idea'),
+                       'author_id': idea.get('author_id'),
+                       'modified': _stamp(self.session, Idea)}
+                author_ids.append(row['author_id'])
+                if self.search_index is not None:
+                    indexed.append(row)
+                yield row
+
+        with self.transaction():
+            ids = self._add_items(Idea, ('author_id', 'title'), rows(),
+                                  chunk_size=chunk_size, validate=validate)
+            new_ids = [id for id in ids if id is not None]
+            self._after_commit(self._invalidate, Idea, new_ids)
+            if self.search_index is not None:
+                self._after_commit(self.search_index.add, self.session, [
+                    dict(row, id=id) for (row, id) in zip(indexed, ids)
+                    if id is not None])
+            self._after_commit(self.counts.add, 'ideas', len(new_ids))
+            for (author_id, id) in zip(author_ids, ids):
+                if id is not None:
+                    self._after_commit(self.counts.add_author, author_id, 1)
+        return ids
+
     def edit_idea(self, id, **kwargs):
         """edit an idea already in the database"""
-        try:
-            self._edit_item(Idea, id, **kwargs)
-        except (NoResultFound, MultipleResultsFound):
-            raise
-        except EditItem:
-            raise EditIdea
-        else:
-            return id
+        with self.transaction():
+            try:
+                self._edit_item(Idea, id, **kwargs)
+            except (NoResultFound, MultipleResultsFound):
+                raise
+            except EditItem:
+                raise EditIdea
+            self._after_commit(self._invalidate, Idea, [id])
+            if self.search_index is not None:
+                self._after_commit(
+                    self.search_index.update, self.session, id, kwargs)
+            if 'author' in kwargs or 'author_id' in kwargs:
+                self._after_commit(self.counts.discard_authors)
+        return id
+
+    def edit_ideas(self, values, filters=None, ids=None):
+        """edit the ideas matching filters, with ids, or both
+           without loading them
+                values is a dict of column names and new values
+                modified is set to now unless values has it
+                filters={} edits every idea
+           return the number of ideas edited"""
+        values = dict(values)
+        ids = list(ids) if ids is not None else None
+        with self.transaction():
+            values.setdefault('modified', _stamp(self.session, Idea))
+            indexed = None
+            if self.search_index is not None and \
+                    set(values) & set(('title', 'idea', 'author_id')):
+                # read before the update, which may change what matches
+                indexed = self._get_ids(Idea, filters=filters, ids=ids)
+            try:
+                count = self._edit_items(
+                    Idea, values, filters=filters, ids=ids)
+            except EditItem:
+                raise EditIdea
+            if filters is None:
+                self._after_commit(self._invalidate, Idea, list(ids))
+            else:
+                self._after_commit(self._invalidate_all)
+            if indexed:
+                self._after_commit(self.search_index.update_many,
+                                   self.session, indexed, values)
+            if 'author_id' in values:
+                self._after_commit(self.counts.discard_authors)
+        return count
 
     def delete_idea(self, id):
         """delete an idea from the database"""
 
-        try:
-            self._delete_item(Idea, id)
-        except InvalidItem:
-            raise InvalidIdea
-        except DeleteItem:
-            raise DeleteIdea
-        else:
-            return id
+        with self.transaction():
+            try:
+                # the tombstone tells us the author, for the counts
+                author_ids = self._add_tombstones(
+                    compile_filters(Idea, {'id': id}), authors=True)
+                # the rowcount tells us whether we still had the idea
+                if not author_ids or not self._delete_items(
+                        Idea, {'id': id}, tombstones=False):
+                    raise InvalidIdea
+            except DeleteItem:
+                raise DeleteIdea
+            self._after_commit(self._invalidate, Idea, [id])
+            if self.search_index is not None:
+                self._after_commit(
+                    self.search_index.remove, self.session, [id])
+            self._after_commit(self.counts.add, 'ideas', -1)
+            self._after_commit(self.counts.add_author, author_ids[0], -1)
+        return id
+
+    def changes_since(self, token=None, limit=None, lag=None):
+        """return up to limit changes to ideas after token, oldest first,
+           and a token to read the changes after these
+                token None reads every idea, and every tombstone
+                a change is ('upsert', id, records.IdeaRecord)
+                for an idea added or edited since token,
+                or ('delete', id, None) for an idea deleted since token
+                changes in the last lag seconds, by default
+                forum.changes_lag, are left for later, as a write is
+                stamped a little before it commits, see _restamp,
+                and must not be skipped
+           ideas are read in the order of modified, then id,
+           deletes in the order of their tombstones
+
+                (changes, token) = forum.changes_since(saved_token)
+                while changes:
+                    ...
+                    (changes, token) = forum.changes_since(token)"""
+        limit = limit or self.chunk_size
+        (idea_after, tombstone_after) = _decode_watermark(token, 2) \
+            if token else (None, None)
+        lag = self.changes_lag if lag is None else lag
+        until = utcnow() - timedelta(seconds=lag)
+
+        record = records[Idea]
+        query = self.session.query(*record.columns).join(Idea.author).filter(
+            Idea.modified <= until)
+        if idea_after:
+            query = query.filter(_after(Idea.modified, Idea.id, idea_after))
+        query = query.order_by(Idea.modified, Idea.id).limit(limit)
+        ideas = [record(*row) for row in self.session.execute(query.statement)]
+        # deletes come first at the same time, as the id may be reused
+        changes = [(idea.modified, 1, 'upsert', idea) for idea in ideas]
+
+        query = self.session.query(
+            Tombstone.created, Tombstone.id, Tombstone.idea_id).filter(
+            Tombstone.created <= until)
+        if tombstone_after:
+            query = query.filter(
+                _after(Tombstone.created, Tombstone.id, tombstone_after))
+        query = query.order_by(Tombstone.created, Tombstone.id).limit(limit)
+        changes.extend((row.created, 0, 'delete', row) for row in query)
+
+        # each list is in order, so the first limit of the two merged
+        # are the first limit changes
+        changes.sort(key=lambda change: (change[0], change[1]))
+        changes = changes[:limit]
+        for (_, _, action, row) in changes:
+            if action == 'upsert':
+                idea_after = (row.modified, row.id)
+            else:
+                tombstone_after = (row.created, row.id)
+        return ([(action, row.id, row) if action == 'upsert'
+                 else (action, row.idea_id, None)
+                 for (_, _, action, row) in changes],
+                _encode_watermark([idea_after, tombstone_after]))
+
+    def purge_tombstones(self, before):
+        """delete the tombstones of ideas deleted before before, in UTC
+           once every reader of changes_since has read past them
+           return the number of tombstones deleted"""
+        with self.transaction():
+            return self.session.query(Tombstone).filter(
+                Tombstone.created < before).delete()
+
+    def search_ideas(self, query, limit=None, cursor=None, load=None):
+        """return a page of the ideas matching every word in query
+           best match first, and a cursor for the next page"""
+        if self.search_index is None:
+            raise InvalidSearch
+        limit = limit or self.ideas_limit
+        offset = _decode_cursor(cursor, 'rank')[0] if cursor else 0
+
+        ids = self.search_index.search(
+            self.session, query, limit + 1, offset=offset)
+        next_cursor = None
+        if len(ids) > limit:
+            ids = ids[:limit]
+            next_cursor = _encode_cursor('rank', offset + limit, ids[-1])
+
+        ideas = self._get_items_by_ids(Idea, ids, load=load or self.ideas_load)
+        return ([idea for idea in ideas if idea is not None], next_cursor)
+
+    def rebuild_search_index(self):
+        """rebuild the search index from the ideas table"""
+        if self.search_index is None:
+            raise InvalidSearch
+        with self.transaction():
+            self.search_index.rebuild(self.session)
+
+    #
+    # Counts
+    #
+
+    def reconcile_counts(self):
+        """rebuild the cached counts from the database"""
+        self.counts.clear()
+        self.counts.set('authors', self._get_item_count(Author))
+        self.counts.set('ideas', self._get_item_count(Idea))
+        query = self.session.query(Author.id, func.count(Idea.id)).outerjoin(
+            Idea, Idea.author_id == Author.id).group_by(Author.id)
+        for (author_id, count) in query:
+            self.counts.set_author(author_id, count)
 
-__all__ = ['Agora', ]
+__all__ = ['Forum', 'validate_schema']
@@ -0,0 +1,215 @@
+#
+# an asyncio forum for agora
+#
+
+import sys
+
+from contextlib import asynccontextmanager
+
+from cullerton.agora.agora import Forum
+
+
+class AsyncForum(object):
+
+    """a forum for ideas on an SQLAlchemy AsyncSession
+
+       each method runs the Forum method of the same name
+       inside the session with AsyncSession.run_sync
+       so validation and exceptions are the same as Forum
+
+       create the session with expire_on_commit=False, and load
+       what you need up front, since lazy loads cannot run
+       outside of the session"""
+
+    def __init__(self, session, **kwargs):
+        """add the SQLAlchemy AsyncSession
+           kwargs are passed on to Forum"""
+        self.session = session
+        self.forum = Forum(session.sync_session, validate=False, **kwargs)
+
+    async def _run(self, method, *args, **kwargs):
+        """return method(*args, **kwargs) run inside the session"""
+        return await self.session.run_sync(
+            lambda session: method(*args, **kwargs))
+
+    async def _iter_pages(self, get_page, filters, limit, order, batch_size,
+                          load):
+        """yield up to limit items, reading them a page at a time"""
+        count = 0
+        cursor = None
+        while limit is None or count < limit:
+            size = batch_size if limit is None else min(
+                batch_size, limit - count)
+            (items, cursor) = await self._run(
+                get_page, filters=filters, limit=size, cursor=cursor,
+                order=order, load=load)
+            for item in items:
+                yield item
+            count += len(items)
+            if cursor is None:
+                break
+
+    async def validate(self):
+        """raise InvalidSession unless the database has our tables"""
+        await self._run(self.forum._validate_session)
+
+    #
+    # Transactions
+    #
+
+    @asynccontextmanager
+    async def transaction(self):
+        """run the forum calls in the async with block in one transaction
+           see Forum.transaction"""
+        scope = self.forum.transaction()
+        await self._run(scope.__enter__)
+        try:
+            yield self
+        except BaseException:
+            if not await self._run(scope.__exit__, *sys.exc_info()):
+                raise
+        else:
+            await self._run(scope.__exit__, None, None, None)
+
+    #
+    # Authors
+    #
+
+    async def get_author_count(self):
+        return await self._run(self.forum.get_author_count)
+
+    async def get_author_idea_count(self, id):
+        return await self._run(self.forum.get_author_idea_count, id)
+
+    async def get_author(self, id):
+        return await self._run(self.forum.get_author, id)
+
+    async def get_authors_by_ids(self, ids, load=None):
+        return await self._run(self.forum.get_authors_by_ids, ids, load=load)
+
+    async def get_author_dict(self, id):
+        return await self._run(self.forum.get_author_dict, id)
+
+    async def get_authors(self, filters={}, limit=None, order=None,
+                          load=None):
+        return await self._run(self.forum.get_authors, filters=filters,
+                               limit=limit, order=order, load=load)
+
+    async def get_author_records(self, filters={}, limit=None, order=None):
+        return await self._run(self.forum.get_author_records,
+                               filters=filters, limit=limit, order=order)
+
+    async def iter_authors(self, filters={}, limit=None, order='id',
+                           batch_size=None, load=None):
+        """yield authors, reading them a page of batch_size at a time
+                order is a column name, as for get_authors_page"""
+        async for author in self._iter_pages(
+                self.forum.get_authors_page, filters, limit, order,
+                batch_size or self.forum.chunk_size, load):
+            yield author
+
+    async def get_authors_page(self, filters={}, limit=None, cursor=None,
+                               order='id', load=None):
+        return await self._run(self.forum.get_authors_page, filters=filters,
+                               limit=limit, cursor=cursor, order=order,
+                               load=load)
+
+    async def add_author(self, username, fullname, email):
+        return await self._run(self.forum.add_author, username, fullname,
+                               email)
+
+    async def add_authors(self, authors, chunk_size=None):
+        return await self._run(self.forum.add_authors, authors,
+                               chunk_size=chunk_size)
+
+    async def edit_author(self, id, **kwargs):
+        return await self._run(self.forum.edit_author, id, **kwargs)
+
+    async def edit_authors(self, values, filters=None, ids=None):
+        return await self._run(self.forum.edit_authors, values, filters=filters,
+                               ids=ids)
+
+    async def delete_author(self, id):
+        return await self._run(self.forum.delete_author, id)
+
+    async def delete_author_ideas(self, id):
+        return await self._run(self.forum.delete_author_ideas, id)
+
+    #
+    # Ideas
+    #
+
+    async def get_idea_count(self):
+        return await self._run(self.forum.get_idea_count)
+
+    async def get_idea(self, id):
+        return await self._run(self.forum.get_idea, id)
+
+    async def get_ideas_by_ids(self, ids, load=None):
+        return await self._run(self.forum.get_ideas_by_ids, ids, load=load)
+
+    async def get_idea_dict(self, id):
+        return await self._run(self.forum.get_idea_dict, id)
+
+    async def get_ideas(self, filters={}, limit=None, order=None, load=None):
+        return await self._run(self.forum.get_ideas, filters=filters,
+                               limit=limit, order=order, load=load)
+
+    async def get_idea_records(self, filters={}, limit=None, order=None):
+        return await self._run(self.forum.get_idea_records, filters=filters,
+                               limit=limit, order=order)
+
+    async def iter_ideas(self, filters={}, limit=None, order='id',
+                         batch_size=None, load=None):
+        """yield ideas, reading them a page of batch_size at a time
+                order is a column name, as for get_ideas_page"""
+        async for idea in self._iter_pages(
+                self.forum.get_ideas_page, filters, limit, order,
+                batch_size or self.forum.chunk_size, load):
+            yield idea
+
+    async def get_ideas_page(self, filters={}, limit=None, cursor=None,
+                             order='id', load=None):
+        return await self._run(self.forum.get_ideas_page, filters=filters,
+                               limit=limit, cursor=cursor, order=order,
+                               load=load)
+
+    async def add_idea(self, title, idea, author_id):
+        return await self._run(self.forum.add_idea, title, idea, author_id)
+
+    async def add_ideas(self, ideas, chunk_size=None):
+        return await self._run(self.forum.add_ideas, ideas,
+                               chunk_size=chunk_size)
+
+    async def edit_idea(self, id, **kwargs):
+        return await self._run(self.forum.edit_idea, id, **kwargs)
+
+    async def edit_ideas(self, values, filters=None, ids=None):
+        return await self._run(self.forum.edit_ideas, values, filters=filters,
+                               ids=ids)
+
+    async def delete_idea(self, id):
+        return await self._run(self.forum.delete_idea, id)
+
+    async def changes_since(self, token=None, limit=None, lag=None):
+        return await self._run(self.forum.changes_since, token=token,
+                               limit=limit, lag=lag)
+
+    async def purge_tombstones(self, before):
+        return await self._run(self.forum.purge_tombstones, before)
+
+    async def search_ideas(self, query, limit=None, cursor=None, load=None):
+        return await self._run(self.forum.search_ideas, query, limit=limit,
+                               cursor=cursor, load=load)
+
+    async def rebuild_search_index(self):
+        return await self._run(self.forum.rebuild_search_index)
+
+    #
+    # Counts
+    #
+
+    async def reconcile_counts(self):
+        return await self._run(self.forum.reconcile_counts)
+
+__all__ = ['AsyncForum']
@@ -0,0 +1,3 @@
+#
+# benchmarks for agora
+#
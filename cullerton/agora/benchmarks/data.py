@@ -0,0 +1,92 @@
+#
+# synthetic forum data for agora benchmarks
+#
+
+import random
+
+from datetime import datetime, timedelta
+from itertools import accumulate, islice
+
+from sqlalchemy import func, select
+
+from cullerton.agora.models import Author, Idea
+
+# ideas per author, on average
+ideas_per_author = 20
+
+# zipf exponent for how ideas are spread over authors
+skew = 1.1
+
+words = ('agora', 'forum', 'idea', 'author', 'debate', 'policy', 'garden',
+         'river', 'market', 'school', 'library', 'bridge', 'music', 'open',
+         'public', 'civic', 'local', 'green', 'quiet', 'shared', 'simple',
+         'better', 'new', 'old', 'small', 'large', 'free', 'fair', 'safe')
+
+
+def generate(ideas, seed=0, authors=None, start=None, chunk_size=10000):
+    """return a list of author rows and an iterator of idea rows
+       for a forum of ideas ideas
+            authors defaults to one for every ideas_per_author ideas
+            idea authors follow a zipf distribution, so a few are prolific
+            the same seed always gives the same rows"""
+    rng = random.Random(seed)
+    author_count = authors or max(1, ideas // ideas_per_author)
+    start = start or datetime(2016, 3, 2)
+    span = 365 * 24 * 3600
+
+    author_rows = [{'id': id,
+                    'username': 'user_%s' % id,
+                    'fullname': 'User %s' % id,
+                    'email': 'user_%s@example.com' % id,
+                    'active': rng.random() < 0.8,
+                    'created': start + timedelta(seconds=rng.randrange(span))}
+                   for id in range(1, author_count + 1)]
+
+    weights = list(accumulate(1.0 / rank ** skew
+                              for rank in range(1, author_count + 1)))
+    # shuffle which ids are prolific, so they are not just the low ids
+    ids = list(range(1, author_count + 1))
+    rng.shuffle(ids)
+
+    def idea_rows():
+        for first in range(1, ideas + 1, chunk_size):
+            count = min(chunk_size, ideas + 1 - first)
+            author_ids = rng.choices(ids, cum_weights=weights, k=count)
+            for (id, author_id) in zip(range(first, first + count),
+                                       author_ids):
+                created = start + timedelta(seconds=rng.randrange(span))
+                yield {'id': id,
+                       'title': 'Idea %s' % id,
+                       'idea': ' '.join(rng.choice(words) for word in
+                                        range(rng.randint(5, 30))),
+                       'visible': rng.random() < 0.9,
+                       'created': created,
+                       'modified': created,
+                       'author_id': author_id}
+
+    return (author_rows, idea_rows())
+
+
+def populate(engine, ideas, seed=0, authors=None, chunk_size=10000):
+    """fill the authors and ideas tables of engine with generated rows
+       using executemany in chunks of chunk_size
+       on PostgreSQL, the id sequence is moved past the generated ids
+       return (author count, idea count)"""
+    (author_rows, idea_rows) = generate(
+        ideas, seed=seed, authors=authors, chunk_size=chunk_size)
+    with engine.begin() as conn:
+        for (table, rows) in ((Author.__table__, iter(author_rows)),
+                              (Idea.__table__, idea_rows)):
+            chunk = list(islice(rows, chunk_size))
+            while chunk:
+                conn.execute(table.insert(), chunk)
+                chunk = list(islice(rows, chunk_size))
+        if engine.dialect.name == 'postgresql':
+            # rows with explicit ids do not advance the id sequence
+            # authors and ideas share, so later adds would collide
+            sequence = Idea.__table__.c.id.default
+            conn.execute(select(func.setval(
+                sequence.name, max(len(author_rows), ideas, 1))))
+    return (len(author_rows), ideas)
+
+__all__ = ['generate', 'populate']
@@ -0,0 +1,283 @@
+#
+# timed Forum scenarios for agora benchmarks
+#
+# usage: python -m cullerton.agora.benchmarks.forum --ideas 100000
+#            [--url postgresql://localhost/agora_bench] [--output run.json]
+#
+# the benchmark drops and recreates the agora tables in the database at url
+#
+
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import tracemalloc
+
+from datetime import datetime
+from time import perf_counter
+
+import sqlalchemy
+
+from sqlalchemy.orm import scoped_session, sessionmaker
+
+from cullerton.agora.agora import Forum
+from cullerton.agora.engine import create_agora_engine
+from cullerton.agora.metrics import Metrics
+from cullerton.agora.models import Base, Idea
+from cullerton.agora.benchmarks.data import populate
+
+# scenario name -> function(forum, rng, size) returning operations done
+# reads come first, writes last, since writes change the data
+scenarios = {}
+
+
+def scenario(function):
+    scenarios[function.__name__] = function
+    return function
+
+
+@scenario
+def get_idea(forum, rng, size):
+    calls = 1000
+    for call in range(calls):
+        forum.get_idea(rng.randint(1, size['ideas']))
+    return calls
+
+
+@scenario
+def get_ideas(forum, rng, size):
+    calls = 100
+    for call in range(calls):
+        [repr(idea) for idea in forum.get_ideas(limit=50, order='-created')]
+    return calls
+
+
+@scenario
+def get_ideas_by_ids(forum, rng, size):
+    calls = 100
+    for call in range(calls):
+        forum.get_ideas_by_ids(
+            [rng.randint(1, size['ideas']) for id in range(100)])
+    return calls
+
+
+@scenario
+def get_ideas_page(forum, rng, size):
+    """walk up to 100 pages of 100 ideas, newest first"""
+    pages = 0
+    cursor = None
+    while pages < 100:
+        (ideas, cursor) = forum.get_ideas_page(
+            limit=100, cursor=cursor, order='-created')
+        pages += 1
+        if cursor is None:
+            break
+    return pages
+
+
+@scenario
+def iter_ideas(forum, rng, size):
+    rows = 0
+    for idea in forum.iter_ideas(batch_size=1000):
+        idea.to_dict()
+        rows += 1
+    return rows
+
+
+@scenario
+def iter_idea_records(forum, rng, size):
+    rows = 0
+    for record in forum.iter_idea_records(batch_size=1000):
+        record.to_dict()
+        rows += 1
+    return rows
+
+
+@scenario
+def list_ideas(forum, rng, size):
+    """list up to 100000 ideas as dicts, the way a list endpoint does"""
+    ideas = forum.get_ideas(limit=100000, order='-created')
+    [idea.to_dict() for idea in ideas]
+    return len(ideas)
+
+
+@scenario
+def list_idea_records(forum, rng, size):
+    """list_ideas with records instead of ideas"""
+    records = forum.get_idea_records(limit=100000, order='-created')
+    [record.to_dict() for record in records]
+    return len(records)
+
+
+@scenario
+def get_idea_count(forum, rng, size):
+    calls = 1000
+    for call in range(calls):
+        forum.get_idea_count()
+        forum.get_author_idea_count(rng.randint(1, size['authors']))
+    return calls
+
+
+@scenario
+def reconcile_counts(forum, rng, size):
+    forum.reconcile_counts()
+    return 1
+
+
+@scenario
+def changes_since(forum, rng, size):
+    """read the change feed from the start, 1000 changes at a time"""
+    changes = 0
+    (page, token) = forum.changes_since(limit=1000)
+    while page:
+        changes += len(page)
+        (page, token) = forum.changes_since(token, limit=1000)
+    return changes
+
+
+@scenario
+def add_idea(forum, rng, size):
+    calls = 500
+    for call in range(calls):
+        forum.add_idea('Benchmark Idea %s' % call, 'This is a benchmark idea.',
+                       rng.randint(1, size['authors']))
+    return calls
+
+
+@scenario
+def add_idea_transaction(forum, rng, size):
+    """add_idea in one transaction, committing once"""
+    calls = 500
+    with forum.transaction():
+        for call in range(calls):
+            forum.add_idea('Transaction Idea %s' % call,
+                           'This is a benchmark idea.',
+                           rng.randint(1, size['authors']))
+    return calls
+
+
+@scenario
+def add_ideas(forum, rng, size):
+    count = min(size['ideas'], 10000)
+    ids = forum.add_ideas({'title': 'Bulk Idea %s' % row,
+                           'idea': 'This is a bulk idea.',
+                           'author_id': rng.randint(1, size['authors'])}
+                          for row in range(count))
+    return len(ids)
+
+
+@scenario
+def edit_ideas(forum, rng, size):
+    """hide the ideas of 100 random authors, one UPDATE each"""
+    rows = 0
+    for call in range(100):
+        rows += forum.edit_ideas(
+            {'visible': False},
+            filters={'author_id': rng.randint(1, size['authors'])})
+    return rows
+
+
+@scenario
+def delete_author(forum, rng, size):
+    """delete the most prolific author, with all their ideas"""
+    (author_id, count) = forum.session.query(
+        Idea.author_id, sqlalchemy.func.count(Idea.id)).group_by(
+        Idea.author_id).order_by(
+        sqlalchemy.func.count(Idea.id).desc()).first()
+    forum.delete_author(author_id)
+    return count
+
+
+def run(url, ideas, seed=0, authors=None, names=None, metrics=False,
+        memory=False):
+    """populate the database at url and time each scenario in names
+       return a dict of results
+            metrics adds the statements each scenario ran
+            memory adds the peak memory each scenario allocated"""
+    engine = create_agora_engine(url)
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+
+    start = perf_counter()
+    (author_count, idea_count) = populate(
+        engine, ideas, seed=seed, authors=authors)
+    size = {'authors': author_count, 'ideas': idea_count}
+    results = {'populate': {'seconds': perf_counter() - start,
+                            'ops': idea_count}}
+
+    session = scoped_session(sessionmaker(bind=engine))
+    rng = random.Random(seed)
+    for name in names or scenarios:
+        session.remove()
+        forum = Forum(session,
+                      metrics=Metrics(slow_query=None) if metrics else None)
+        if memory:
+            tracemalloc.start()
+        start = perf_counter()
+        ops = scenarios[name](forum, rng, size)
+        results[name] = {'seconds': perf_counter() - start, 'ops': ops}
+        if memory:
+            results[name]['peak_bytes'] = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        if metrics:
+            results[name]['statements'] = sum(
+                method['statements'] for method in
+                forum.metrics.snapshot()['methods'].values())
+            forum.metrics.detach(engine)
+    session.remove()
+    engine.dispose()
+
+    for result in results.values():
+        result['ops_per_second'] = (result['ops'] / result['seconds']
+                                    if result['seconds'] else None)
+    return {'meta': {'url': engine.url.render_as_string(hide_password=True),
+                     'ideas': idea_count,
+                     'authors': author_count,
+                     'seed': seed,
+                     'date': datetime.now().isoformat(),
+                     'python': platform.python_version(),
+                     'sqlalchemy': sqlalchemy.__version__},
+            'results': results}
+
+
+def main(argv=sys.argv):
+    parser = argparse.ArgumentParser(
+        prog=os.path.basename(argv[0]),
+        description='time Forum scenarios on a synthetic forum')
+    parser.add_argument('--ideas', type=int, default=1000)
+    parser.add_argument('--authors', type=int, default=None)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--url', default=None,
+                        help='database to use, its agora tables are dropped '
+                             '(default: a temporary SQLite file)')
+    parser.add_argument('--scenario', action='append', dest='names',
+                        choices=sorted(scenarios))
+    parser.add_argument('--metrics', action='store_true',
+                        help='count the SQL statements of each scenario')
+    parser.add_argument('--memory', action='store_true',
+                        help='trace the peak memory of each scenario, '
+                             'which slows them down')
+    parser.add_argument('--output', default=None,
+                        help='file for the JSON results (default: stdout)')
+    args = parser.parse_args(argv[1:])
+
+    with tempfile.TemporaryDirectory() as directory:
+        url = args.url or 'sqlite:///%s' % os.path.join(
+            directory, 'bench.sqlite')
+        results = run(url, args.ideas, seed=args.seed, authors=args.authors,
+                      names=args.names, metrics=args.metrics,
+                      memory=args.memory)
+
+    output = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+#
+# import time benchmark for agora
+#
+# usage: python -m cullerton.agora.benchmarks.importtime [module] [runs]
+#
+
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+# the directory holding the cullerton package
+root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__)))))
+
+
+def import_times(module='cullerton.agora'):
+    """import module in a fresh interpreter with python -X importtime
+       in an empty working directory
+       return a dict of cumulative import microseconds by module name
+            and the list of files the import left in the directory"""
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [root] + [path for path in env.get('PYTHONPATH', '').split(
+            os.pathsep) if path])
+    with tempfile.TemporaryDirectory() as directory:
+        process = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', 'import %s' % module],
+            cwd=directory, env=env, stderr=subprocess.PIPE,
+            universal_newlines=True, check=True)
+        files = os.listdir(directory)
+
+    times = {}
+    for line in process.stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        fields = line[len('import time:'):].split('|')
+        try:
+            times[fields[2].strip()] = int(fields[1])
+        except ValueError:
+            # the header line
+            continue
+    return (times, files)
+
+
+def benchmark(module='cullerton.agora', runs=5):
+    """return a dict summarizing runs imports of module"""
+    results = [import_times(module) for run in range(runs)]
+    cumulative = sorted(times[module] for (times, files) in results)
+    (times, files) = results[-1]
+    return {'module': module,
+            'runs': runs,
+            'best_us': cumulative[0],
+            'median_us': cumulative[len(cumulative) // 2],
+            'modules': len(times),
+            'sqlalchemy': 'sqlalchemy' in times,
+            'files': files}
+
+
+def main(argv=sys.argv):
+    module = argv[1] if len(argv) > 1 else 'cullerton.agora'
+    runs = int(argv[2]) if len(argv) > 2 else 5
+    print(json.dumps(benchmark(module, runs), indent=2, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,248 @@
+#
+# concurrency stress harness for agora
+#
+# usage: python -m cullerton.agora.benchmarks.stress --threads 8
+#            [--processes 4] [--seconds 10] [--ideas 10000]
+#            [--url postgresql://localhost/agora_bench] [--output run.json]
+#
+# threads in each process share one Forum, with a session for each thread
+# the stress test drops and recreates the agora tables in the database at url
+#
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import random
+import sys
+import tempfile
+import threading
+
+from datetime import datetime
+from time import perf_counter
+
+import sqlalchemy
+
+from sqlalchemy.orm import sessionmaker
+
+from cullerton.agora.agora import Forum
+from cullerton.agora.engine import create_agora_engine, pool_stats
+from cullerton.agora.metrics import Histogram, seconds_buckets
+from cullerton.agora.models import Base
+from cullerton.agora.benchmarks.data import populate
+
+# operation name -> (weight, function(forum, rng, size))
+operations = {
+    'get_ideas': (60, lambda forum, rng, size: forum.get_ideas(
+        filters={'author_id': rng.randint(1, size['authors'])}, limit=20)),
+    'add_idea': (35, lambda forum, rng, size: forum.add_idea(
+        'Stress Idea %s' % rng.getrandbits(64), 'This is a stress idea.',
+        rng.randint(1, size['authors']))),
+    'delete_author': (5, lambda forum, rng, size: forum.delete_author(
+        rng.randint(1, size['authors']))),
+}
+
+
+def _locked(error):
+    """return whether error, or an error it was raised from,
+       is the database being locked or busy"""
+    while error is not None:
+        if 'locked' in str(error) or 'busy' in str(error):
+            return True
+        error = error.__cause__ or error.__context__
+    return False
+
+
+class _Stats(object):
+
+    """counts, errors, and latencies of each operation
+       merged across threads and processes"""
+
+    def __init__(self):
+        self.ops = dict((name, {'count': 0,
+                                'errors': {},
+                                'locked': 0,
+                                'latency': Histogram(seconds_buckets)})
+                        for name in operations)
+
+    def record(self, name, seconds, error=None):
+        op = self.ops[name]
+        op['count'] += 1
+        op['latency'].observe(seconds)
+        if error is not None:
+            kind = type(error).__name__
+            op['errors'][kind] = op['errors'].get(kind, 0) + 1
+            if _locked(error):
+                op['locked'] += 1
+
+    def merge(self, other):
+        for (name, op) in other.items():
+            mine = self.ops[name]
+            mine['count'] += op['count']
+            mine['locked'] += op['locked']
+            for (kind, count) in op['errors'].items():
+                mine['errors'][kind] = mine['errors'].get(kind, 0) + count
+            for (index, count) in enumerate(op['latency']['counts']):
+                mine['latency'].counts[index] += count
+            mine['latency'].sum += op['latency']['sum']
+            mine['latency'].count += op['latency']['count']
+
+    def dump(self):
+        """return the stats as plain data, to send between processes"""
+        return dict((name, dict(op, errors=dict(op['errors']), latency={
+            'counts': op['latency'].counts,
+            'sum': op['latency'].sum,
+            'count': op['latency'].count})) for (name, op) in self.ops.items())
+
+
+def _percentile(histogram, fraction):
+    """return the bucket bound at or below which fraction of values fall
+       None past the last bound"""
+    target = histogram.count * fraction
+    for (bound, count) in histogram.cumulative():
+        if count >= target:
+            return bound if bound != float('inf') else None
+    return None
+
+
+def _thread(forum, size, seed, deadline, stats, lock):
+    rng = random.Random(seed)
+    names = list(operations)
+    weights = [operations[name][0] for name in names]
+    local = _Stats()
+    while perf_counter() < deadline:
+        name = rng.choices(names, weights)[0]
+        start = perf_counter()
+        error = None
+        try:
+            operations[name][1](forum, rng, size)
+        except Exception as e:
+            error = e
+        finally:
+            forum.session.remove()
+        local.record(name, perf_counter() - start, error)
+    with lock:
+        stats.merge(local.dump())
+
+
+def _process(engine, threads, seconds, size, seed, queue=None):
+    """run threads sharing one Forum for seconds
+       return the stats as plain data, or put them on queue"""
+    if isinstance(engine, str):
+        engine = create_agora_engine(engine)
+    forum = Forum(sessionmaker(bind=engine), validate=False)
+    stats = _Stats()
+    lock = threading.Lock()
+    deadline = perf_counter() + seconds
+    workers = [threading.Thread(target=_thread, args=(
+        forum, size, seed * 1000 + index, deadline, stats, lock))
+        for index in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    result = {'ops': stats.dump(), 'pool': pool_stats(engine)}
+    if queue is None:
+        return result
+    queue.put(result)
+
+
+def run(url, threads=4, processes=1, seconds=5.0, ideas=10000, seed=0):
+    """populate the database at url, then run operations from threads
+       in each of processes for seconds
+       return a dict of results"""
+    engine = create_agora_engine(url)
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    (author_count, idea_count) = populate(engine, ideas, seed=seed)
+    size = {'authors': author_count, 'ideas': idea_count}
+
+    stats = _Stats()
+    pools = []
+    if processes <= 1:
+        result = _process(engine, threads, seconds, size, seed)
+        stats.merge(result['ops'])
+        pools.append(result['pool'])
+    else:
+        # forked children inherit the engine, with fresh pools
+        # elsewhere they connect again
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context(
+            'fork' if 'fork' in methods else 'spawn')
+        target = engine if 'fork' in methods else url
+        queue = context.Queue()
+        children = [context.Process(target=_process, args=(
+            target, threads, seconds, size, seed + index, queue))
+            for index in range(1, processes + 1)]
+        for child in children:
+            child.start()
+        for child in children:
+            result = queue.get()
+            stats.merge(result['ops'])
+            pools.append(result['pool'])
+        for child in children:
+            child.join()
+    engine.dispose()
+
+    results = {}
+    for (name, op) in stats.ops.items():
+        latency = op['latency']
+        results[name] = {
+            'ops': op['count'],
+            'ops_per_second': op['count'] / seconds,
+            'errors': op['errors'],
+            'error_rate': (sum(op['errors'].values()) / op['count']
+                           if op['count'] else 0),
+            'locked': op['locked'],
+            'mean_seconds': latency.sum / latency.count
+            if latency.count else None,
+            'p50_seconds': _percentile(latency, 0.5),
+            'p99_seconds': _percentile(latency, 0.99)}
+    return {'meta': {'url': engine.url.render_as_string(hide_password=True),
+                     'threads': threads,
+                     'processes': processes,
+                     'seconds': seconds,
+                     'ideas': idea_count,
+                     'authors': author_count,
+                     'seed': seed,
+                     'date': datetime.now().isoformat(),
+                     'python': platform.python_version(),
+                     'sqlalchemy': sqlalchemy.__version__},
+            'results': results,
+            'pools': pools}
+
+
+def main(argv=sys.argv):
+    parser = argparse.ArgumentParser(
+        prog=os.path.basename(argv[0]),
+        description='hammer a Forum from many threads and processes')
+    parser.add_argument('--threads', type=int, default=4,
+                        help='threads in each process')
+    parser.add_argument('--processes', type=int, default=1)
+    parser.add_argument('--seconds', type=float, default=5.0)
+    parser.add_argument('--ideas', type=int, default=10000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--url', default=None,
+                        help='database to use, its agora tables are dropped '
+                             '(default: a temporary SQLite file)')
+    parser.add_argument('--output', default=None,
+                        help='file for the JSON results (default: stdout)')
+    args = parser.parse_args(argv[1:])
+
+    with tempfile.TemporaryDirectory() as directory:
+        url = args.url or 'sqlite:///%s' % os.path.join(
+            directory, 'stress.sqlite')
+        results = run(url, threads=args.threads, processes=args.processes,
+                      seconds=args.seconds, ideas=args.ideas, seed=args.seed)
+
+    output = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+#
+# read-through caches for agora
+#
+
+from collections import OrderedDict
+from threading import Lock
+from time import monotonic
+
+
+class CacheBackend(object):
+    """the interface a Forum cache implements
+       keys are (table name, id) tuples, values are to_dict() payloads"""
+
+    def get(self, key):
+        """return the value cached for key, or None"""
+        raise NotImplementedError
+
+    def set(self, key, value):
+        """cache value for key"""
+        raise NotImplementedError
+
+    def delete(self, key):
+        """forget the value cached for key"""
+        raise NotImplementedError
+
+    def clear(self):
+        """forget every cached value"""
+        raise NotImplementedError
+
+    def stats(self):
+        """return a dict of counters"""
+        return {}
+
+
+class LRUCache(CacheBackend):
+
+    """a bounded in-process cache
+       least recently used values are evicted past maxsize
+       values expire ttl seconds after they are set, never if ttl is None"""
+
+    def __init__(self, maxsize=1024, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._items = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key):
+        with self._lock:
+            try:
+                (expires, value) = self._items[key]
+            except KeyError:
+                self.misses += 1
+                return None
+            if expires is not None and expires < monotonic():
+                del self._items[key]
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        expires = monotonic() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            self._items[key] = (expires, value)
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._items.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def stats(self):
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'size': len(self._items)}
+
+__all__ = ['CacheBackend', 'LRUCache']
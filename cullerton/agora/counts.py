@@ -0,0 +1,85 @@
+#
+# cached item counts for agora
+#
+
+from threading import Lock
+from time import monotonic
+
+# seconds a count is served from the cache before it is read again
+ttl = 60.0
+
+
+class Counts(object):
+
+    """cached counts of authors and ideas
+       totals are keyed by table name, idea counts per author by author id
+       a missing or expired count is read from the database by the forum
+       the forum adjusts cached counts as it adds and deletes items,
+       but writes by other forums, or other processes, only show once
+       the count expires, after ttl seconds, or never when ttl is None
+
+       forums do not share counts unless they are given the same Counts,
+       so make one for each process and pass it to every Forum"""
+
+    def __init__(self, ttl=ttl):
+        self.ttl = ttl
+        # name -> [count, monotonic time it expires]
+        self.totals = {}
+        self.authors = {}
+        self._lock = Lock()
+
+    def _get(self, counts, key):
+        entry = counts.get(key)
+        if entry is None:
+            return None
+        if entry[1] is not None and entry[1] <= monotonic():
+            counts.pop(key, None)
+            return None
+        return entry[0]
+
+    def _set(self, counts, key, count):
+        counts[key] = [count, None if self.ttl is None
+                       else monotonic() + self.ttl]
+
+    def _add(self, counts, key, delta):
+        with self._lock:
+            entry = counts.get(key)
+            if entry is not None:
+                entry[0] += delta
+
+    def get(self, table):
+        """return the cached total for table, or None"""
+        return self._get(self.totals, table)
+
+    def set(self, table, count):
+        self._set(self.totals, table, count)
+
+    def add(self, table, delta):
+        """adjust the cached total for table by delta, if we have one"""
+        self._add(self.totals, table, delta)
+
+    def get_author(self, author_id):
+        """return the cached idea count for author_id, or None"""
+        return self._get(self.authors, author_id)
+
+    def set_author(self, author_id, count):
+        self._set(self.authors, author_id, count)
+
+    def add_author(self, author_id, delta):
+        """adjust the cached idea count for author_id by delta,
+           if we have one"""
+        self._add(self.authors, author_id, delta)
+
+    def discard_author(self, author_id):
+        self.authors.pop(author_id, None)
+
+    def discard_authors(self):
+        """forget every per author idea count"""
+        self.authors.clear()
+
+    def clear(self):
+        """forget every count"""
+        self.totals.clear()
+        self.authors.clear()
+
+__all__ = ['Counts']
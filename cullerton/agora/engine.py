@@ -0,0 +1,285 @@
+#
+# engine configuration for agora
+#
+
+import os
+
+from itertools import count
+from threading import Lock
+from weakref import WeakKeyDictionary, ref
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.pool import QueuePool
+
+default_url = 'sqlite:///agora.sqlite'
+
+# environment variable, create_engine argument, type
+environ_options = (
+    ('AGORA_POOL_SIZE', 'pool_size', int),
+    ('AGORA_MAX_OVERFLOW', 'max_overflow', int),
+    ('AGORA_POOL_TIMEOUT', 'pool_timeout', float),
+    ('AGORA_POOL_RECYCLE', 'pool_recycle', int),
+    ('AGORA_POOL_PRE_PING', 'pool_pre_ping',
+     lambda value: value.lower() in ('1', 'true', 'yes', 'on')),
+)
+
+# options only a QueuePool takes
+queue_pool_options = ('pool_size', 'max_overflow', 'pool_timeout')
+
+sqlite_pragmas = (
+    ('journal_mode', 'WAL'),
+    ('synchronous', 'NORMAL'),
+    ('mmap_size', 268435456),
+    ('busy_timeout', 5000),
+    ('foreign_keys', 'ON'),
+)
+
+# read replica strategies
+strategies = ('round_robin', 'least_connections')
+
+_engine = None
+_replicas = None
+_engine_lock = Lock()
+_pool_stats = WeakKeyDictionary()
+
+
+class PoolStats(object):
+
+    """connection pool counters kept from pool events"""
+
+    def __init__(self, engine):
+        self.engine = ref(engine)
+        self.connects = 0
+        self.checkouts = 0
+        self.checkins = 0
+        self.invalidations = 0
+        self.checked_out = 0
+        self.peak_checked_out = 0
+        self._lock = Lock()
+        event.listen(engine, 'connect', self._connect)
+        event.listen(engine, 'checkout', self._checkout)
+        event.listen(engine, 'checkin', self._checkin)
+        event.listen(engine, 'invalidate', self._invalidate)
+
+    def _connect(self, dbapi_connection, connection_record):
+        with self._lock:
+            self.connects += 1
+
+    def _checkout(self, dbapi_connection, connection_record,
+                  connection_proxy):
+        with self._lock:
+            self.checkouts += 1
+            self.checked_out += 1
+            self.peak_checked_out = max(self.peak_checked_out,
+                                        self.checked_out)
+
+    def _checkin(self, dbapi_connection, connection_record):
+        with self._lock:
+            self.checkins += 1
+            self.checked_out = max(self.checked_out - 1, 0)
+
+    def _invalidate(self, dbapi_connection, connection_record, exception):
+        with self._lock:
+            self.invalidations += 1
+
+    def _after_fork(self):
+        # the counters describe the parent's connections
+        self._lock = Lock()
+        self.checked_out = 0
+        self.peak_checked_out = 0
+
+    def snapshot(self):
+        """return a dict of the counters and the pool status"""
+        return {'connects': self.connects,
+                'checkouts': self.checkouts,
+                'checkins': self.checkins,
+                'invalidations': self.invalidations,
+                'checked_out': self.checked_out,
+                'peak_checked_out': self.peak_checked_out,
+                'pool': self.engine().pool.status()}
+
+
+class ReplicaSet(object):
+
+    """read replica engines, and how to choose one for a read
+            strategy is 'round_robin', or 'least_connections'
+            to choose the engine with the fewest connections checked out"""
+
+    def __init__(self, engines, strategy='round_robin'):
+        if strategy not in strategies:
+            raise ValueError("unknown replica strategy: %s" % strategy)
+        self.engines = list(engines)
+        self.strategy = strategy
+        self._next = count()
+        for engine in self.engines:
+            if engine not in _pool_stats:
+                _pool_stats[engine] = PoolStats(engine)
+
+    def __len__(self):
+        return len(self.engines)
+
+    def choose(self):
+        """return the engine for the next read"""
+        if self.strategy == 'least_connections':
+            return min(self.engines,
+                       key=lambda engine: _pool_stats[engine].checked_out)
+        return self.engines[next(self._next) % len(self.engines)]
+
+    def dispose(self):
+        for engine in self.engines:
+            engine.dispose()
+
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    for (name, value) in sqlite_pragmas:
+        cursor.execute('PRAGMA %s = %s' % (name, value))
+    cursor.close()
+
+
+def _sqlite_connect(dbapi_connection, connection_record):
+    # stop the driver from beginning and committing on its own
+    dbapi_connection.isolation_level = None
+
+
+def _sqlite_begin(conn):
+    # on the driver connection, so statement counts do not include it
+    # a transaction that will write takes the write lock up front,
+    # as SQLite cannot wait to upgrade a read to a write
+    cursor = conn.connection.cursor()
+    cursor.execute('BEGIN IMMEDIATE' if conn.get_execution_options().get(
+        'agora_write') else 'BEGIN')
+    cursor.close()
+
+
+def sqlite_transactions(engine):
+    """have SQLAlchemy begin the transactions of SQLite engine,
+       rather than the sqlite3 driver, so savepoints work
+       and Forum.transaction can nest
+       connections with the agora_write execution option
+       begin immediately, taking the write lock"""
+    engine = getattr(engine, 'sync_engine', engine)
+    event.listen(engine, 'connect', _sqlite_connect)
+    event.listen(engine, 'begin', _sqlite_begin)
+
+
+def engine_config(environ=None):
+    """return the database url and create_engine options from environ
+            AGORA_DATABASE_URL, AGORA_POOL_SIZE, AGORA_MAX_OVERFLOW,
+            AGORA_POOL_TIMEOUT, AGORA_POOL_RECYCLE, AGORA_POOL_PRE_PING"""
+    environ = os.environ if environ is None else environ
+    url = environ.get('AGORA_DATABASE_URL', default_url)
+    options = {}
+    for (name, option, convert) in environ_options:
+        if environ.get(name):
+            options[option] = convert(environ[name])
+    return (url, options)
+
+
+def replica_config(environ=None):
+    """return the read replica urls and strategy from environ
+            AGORA_REPLICA_URLS, comma separated, and AGORA_REPLICA_STRATEGY"""
+    environ = os.environ if environ is None else environ
+    urls = [url.strip() for url in
+            environ.get('AGORA_REPLICA_URLS', '').split(',') if url.strip()]
+    return (urls, environ.get('AGORA_REPLICA_STRATEGY') or 'round_robin')
+
+
+def create_agora_engine(url=None, environ=None, **options):
+    """return a new engine configured from environ
+            url and options override the environment
+            SQLite connections get sqlite_pragmas
+            and sqlite_transactions"""
+    (config_url, config_options) = engine_config(environ)
+    url = make_url(url or config_url)
+    options = dict(config_options, **options)
+
+    sqlite = url.get_backend_name() == 'sqlite'
+    memory = url.database in (None, '', ':memory:')
+    if sqlite and not memory and 'poolclass' not in options and \
+            set(options) & set(queue_pool_options):
+        # file databases default to a pool without a size
+        options['poolclass'] = QueuePool
+
+    engine = create_engine(url, **options)
+    if sqlite:
+        event.listen(engine, 'connect', _set_sqlite_pragmas)
+        sqlite_transactions(engine)
+    _pool_stats[engine] = PoolStats(engine)
+    return engine
+
+
+def get_engine():
+    """return the configured engine, creating it on first use"""
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = create_agora_engine()
+    return _engine
+
+
+def configure_engine(url=None, **options):
+    """replace the configured engine
+            url and options are passed to create_agora_engine"""
+    global _engine
+    with _engine_lock:
+        if _engine is not None:
+            _engine.dispose()
+        _engine = create_agora_engine(url, **options)
+    return _engine
+
+
+def get_replicas():
+    """return the configured ReplicaSet, creating it on first use
+       None when there are no replicas"""
+    global _replicas
+    if _replicas is None:
+        (urls, strategy) = replica_config()
+        if urls:
+            with _engine_lock:
+                if _replicas is None:
+                    _replicas = ReplicaSet(
+                        [create_agora_engine(url) for url in urls],
+                        strategy=strategy)
+    return _replicas
+
+
+def configure_replicas(urls, strategy='round_robin', **options):
+    """replace the configured read replicas
+            urls and options are passed to create_agora_engine
+            no urls turns replicas off"""
+    global _replicas
+    with _engine_lock:
+        if _replicas is not None:
+            _replicas.dispose()
+        _replicas = ReplicaSet(
+            [create_agora_engine(url, **options) for url in urls],
+            strategy=strategy) if urls else None
+    return _replicas
+
+
+def _after_fork():
+    """give a forked child fresh pools for the engines we made
+       the parent's connections are left open for the parent"""
+    global _engine_lock
+    _engine_lock = Lock()
+    for (engine, stats) in list(_pool_stats.items()):
+        engine.dispose(close=False)
+        stats._after_fork()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork)
+
+
+def pool_stats(engine=None):
+    """return the pool counters for engine, the configured engine by default
+       None for an engine not made by create_agora_engine"""
+    stats = _pool_stats.get(engine if engine is not None else get_engine())
+    return stats.snapshot() if stats is not None else None
+
+__all__ = ['create_agora_engine', 'configure_engine', 'engine_config',
+           'get_engine', 'pool_stats', 'sqlite_transactions', 'ReplicaSet',
+           'replica_config', 'get_replicas', 'configure_replicas']
@@ -10,6 +10,22 @@ class DuplicateAuthor(Exception):
     pass
 
 
+class DuplicateItem(Exception):
+    pass
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+class InvalidFilter(Exception):
+    pass
+
+
+class InvalidSearch(Exception):
+    pass
+
+
 class InvalidItem(Exception):
     pass
 
@@ -57,8 +73,9 @@ class EditIdea(Exception):
 class EditAuthor(Exception):
     pass
 
-__all__ = ['InvalidSession', 'InvalidItem', 'InvalidIdea', 'InvalidAuthor',
-           'AddItem', 'EditItem', 'DeleteItem',
+__all__ = ['InvalidSession', 'InvalidCursor', 'InvalidFilter', 'InvalidSearch',
+           'InvalidItem', 'InvalidIdea', 'InvalidAuthor',
+           'AddItem', 'EditItem', 'DeleteItem', 'DuplicateItem',
            'AddIdea', 'EditIdea', 'DeleteIdea', 'DuplicateIdea',
            'AddAuthor', 'EditAuthor', 'DeleteAuthor', 'DuplicateAuthor',
            ]
@@ -0,0 +1,150 @@
+#
+# streaming export of ideas and authors for agora
+#
+# usage: export_agora <database_uri> <ideas|authors> <output>
+#            [--format jsonl|csv] [--filter name=value] [--order name]
+#            [--limit n]
+#
+# output is a file name, or - for stdout; names ending in .gz are gzipped
+#
+
+import argparse
+import csv
+import gzip
+import json
+import os
+import sys
+
+from datetime import date, datetime
+
+from sqlalchemy import DateTime
+from sqlalchemy.orm import Session
+
+from cullerton.agora.engine import create_agora_engine
+from cullerton.agora.models import Author, Idea
+
+
+def _value(value):
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    return value
+
+
+def write_jsonl(file, fields, rows):
+    """write each row to file as a JSON object on its own line
+       return the number of rows written"""
+    count = 0
+    encode = json.JSONEncoder(default=_value).encode
+    for row in rows:
+        file.write(encode(dict(zip(fields, row))))
+        file.write('\n')
+        count += 1
+    return count
+
+
+def write_csv(file, fields, rows):
+    """write a header of fields, then each row, to file as CSV
+       return the number of rows written"""
+    count = 0
+    writer = csv.writer(file)
+    writer.writerow(fields)
+    for row in rows:
+        writer.writerow([_value(value) for value in row])
+        count += 1
+    return count
+
+
+writers = {'jsonl': write_jsonl, 'csv': write_csv}
+
+
+def write(file, fields, rows, format='jsonl'):
+    """write rows, tuples of values for fields, to file in format
+       datetimes are written in ISO 8601
+       return the number of rows written"""
+    try:
+        writer = writers[format]
+    except KeyError:
+        raise ValueError("unknown export format: %s" % format)
+    return writer(file, fields, rows)
+
+
+def open_output(path, compress=None):
+    """return a text file to write to path, stdout for -
+            compress gzips the file, by default when path ends in .gz"""
+    if path == '-':
+        return sys.stdout
+    if compress is None:
+        compress = path.endswith('.gz')
+    if compress:
+        return gzip.open(path, 'wt', encoding='utf-8', newline='')
+    return open(path, 'w', encoding='utf-8', newline='')
+
+
+def _format(path):
+    """return the format for path from its extension"""
+    name = path[:-3] if path.endswith('.gz') else path
+    return 'csv' if name.endswith('.csv') else 'jsonl'
+
+
+def _filters(table, values):
+    """return a dict of filters from name=value strings
+       values are read as JSON where they can be, as text otherwise
+       and as ISO 8601 for datetime columns"""
+    filters = {}
+    for item in values:
+        (key, _, value) = item.partition('=')
+        column = getattr(table, key.partition('__')[0], None)
+        if column is not None and isinstance(
+                getattr(column, 'type', None), DateTime):
+            value = datetime.fromisoformat(value)
+        else:
+            try:
+                value = json.loads(value)
+            except ValueError:
+                pass
+        filters[key] = value
+    return filters
+
+
+def main(argv=sys.argv):
+    parser = argparse.ArgumentParser(
+        prog=os.path.basename(argv[0]),
+        description='export agora ideas or authors as JSON Lines or CSV')
+    parser.add_argument('database_uri')
+    parser.add_argument('table', choices=('ideas', 'authors'))
+    parser.add_argument('output', help='a file name, or - for stdout; '
+                                       'names ending in .gz are gzipped')
+    parser.add_argument('--format', choices=sorted(writers),
+                        help='default: csv for .csv files, jsonl otherwise')
+    parser.add_argument('--filter', action='append', default=[],
+                        dest='filters', metavar='NAME=VALUE',
+                        help='e.g. author_id=1 or created__gte=2016-03-02')
+    parser.add_argument('--order', default='id')
+    parser.add_argument('--limit', type=int, default=None)
+    args = parser.parse_args(argv[1:])
+
+    # agora imports this module
+    from cullerton.agora.agora import Forum
+
+    table = Idea if args.table == 'ideas' else Author
+    engine = create_agora_engine(args.database_uri)
+    session = Session(bind=engine)
+    forum = Forum(session)
+    export = forum.export_ideas if table is Idea else forum.export_authors
+    file = open_output(args.output)
+    try:
+        count = export(file, format=args.format or _format(args.output),
+                       filters=_filters(table, args.filters),
+                       limit=args.limit, order=args.order)
+    finally:
+        if file is not sys.stdout:
+            file.close()
+        session.close()
+        engine.dispose()
+    print('exported %s %s' % (count, args.table), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
+
+__all__ = ['write', 'write_jsonl', 'write_csv', 'open_output']
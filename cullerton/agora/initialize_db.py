@@ -2,8 +2,9 @@ import os
 import sys
 # import transaction
 
-from sqlalchemy import create_engine
+from sqlalchemy import Index, MetaData, UniqueConstraint, inspect
 
+from .engine import create_agora_engine
 from .models import Idea, Author, Base
 from .session import DBSession
 
@@ -18,15 +19,39 @@ def usage(argv):
     sys.exit(1)
 
 
+def create_schema(engine):
+    """create the tables, and the indexes of existing tables, that are
+       missing from the database of engine
+            create_all skips tables that exist, with their indexes
+            a named unique constraint missing from an existing table
+            is added as a unique index of the same name"""
+    Base.metadata.create_all(engine)
+    inspector = inspect(engine)
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(engine, checkfirst=True)
+        names = set(constraint['name'] for constraint in
+                    inspector.get_unique_constraints(table.name))
+        names.update(index['name']
+                     for index in inspector.get_indexes(table.name))
+        for constraint in table.constraints:
+            if (isinstance(constraint, UniqueConstraint) and
+                    constraint.name and constraint.name not in names):
+                copy = table.to_metadata(MetaData())
+                Index(constraint.name,
+                      *[copy.c[column.name] for column in constraint.columns],
+                      unique=True).create(engine)
+
+
 def main(argv=sys.argv):
     if not 2 <= len(argv) <= 3:
         usage(argv)
     database_uri = argv[1]
     seed = argv[2] if len(argv) > 2 else False
 
-    engine = create_engine(database_uri)
+    engine = create_agora_engine(database_uri)
     DBSession.configure(bind=engine)
-    Base.metadata.create_all(engine)
+    create_schema(engine)
 
     if seed == 'seed':
         author = Author(username='misinformation',
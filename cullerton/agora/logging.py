@@ -1,15 +1,18 @@
-from logging import getLogger, FileHandler, DEBUG  # , StreamHandler
+from logging import getLogger, FileHandler, NullHandler, DEBUG
 
 logger = getLogger(__name__)
 logger.setLevel(DEBUG)
 
-# ch = StreamHandler()
-# ch.setLevel(INFO)
+# nothing is written until an application adds a handler
+logger.addHandler(NullHandler())
 
-fh = FileHandler('agora.log')
-fh.setLevel(DEBUG)
 
-# logger.addHandler(ch)
-logger.addHandler(fh)
+def enable_file_logging(filename='agora.log', level=DEBUG):
+    """log to filename at level
+       return the handler"""
+    fh = FileHandler(filename)
+    fh.setLevel(level)
+    logger.addHandler(fh)
+    return fh
 
-__all__ = ('logger')
+__all__ = ('logger', 'enable_file_logging')
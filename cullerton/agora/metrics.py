@@ -0,0 +1,323 @@
+#
+# query instrumentation for agora
+#
+
+from bisect import bisect_left
+from contextvars import ContextVar
+from functools import wraps
+from inspect import isgenerator
+from threading import Lock
+from time import perf_counter
+from weakref import WeakSet
+
+from sqlalchemy import event
+from sqlalchemy.orm import scoped_session
+
+from cullerton.agora.engine import get_replicas
+from cullerton.agora.logging import logger
+from cullerton.agora.session import RoutingSession
+
+# upper bounds of the latency buckets, in seconds
+seconds_buckets = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# upper bounds of the statements per call buckets
+statements_buckets = (0, 1, 2, 3, 5, 10, 25, 50, 100)
+
+# the Forum method call statements are counted against
+_call = ContextVar('agora_call', default=None)
+
+
+class Histogram(object):
+
+    """counts of observed values at or below each bucket bound
+       plus a sum and a total count"""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        """return (bound, count) pairs, the last bound is inf"""
+        total = 0
+        pairs = []
+        for (bound, count) in zip(self.buckets + (float('inf'),),
+                                  self.counts):
+            total += count
+            pairs.append((bound, total))
+        return pairs
+
+    def snapshot(self):
+        return {'buckets': self.cumulative(),
+                'sum': self.sum,
+                'count': self.count}
+
+
+class _Call(object):
+
+    """statements run by one Forum method call"""
+
+    __slots__ = ('method', 'statements', 'statement_seconds')
+
+    def __init__(self, method):
+        self.method = method
+        self.statements = 0
+        self.statement_seconds = 0.0
+
+
+class _MethodStats(object):
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.statements = 0
+        self.statement_seconds = 0.0
+        self.seconds = Histogram(seconds_buckets)
+        self.statements_per_call = Histogram(statements_buckets)
+
+    def snapshot(self):
+        return {'calls': self.calls,
+                'errors': self.errors,
+                'statements': self.statements,
+                'statement_seconds': self.statement_seconds,
+                'seconds': self.seconds.snapshot(),
+                'statements_per_call': self.statements_per_call.snapshot()}
+
+
+class Metrics(object):
+
+    """opt-in counters for Forum method calls and the SQL they run
+
+       pass to Forum(session, metrics=Metrics()) to record, per method,
+       calls, errors, statements, and latency and statements per call
+       histograms; statements come from engine events, so anything
+       that runs SQL inside a method call is counted against it
+
+       statements slower than slow_query seconds are logged as warnings,
+       None turns the slow query log off"""
+
+    def __init__(self, slow_query=0.5):
+        self.slow_query = slow_query
+        self.statements = Histogram(seconds_buckets)
+        self.slow_queries = 0
+        self.methods = {}
+        self._engines = WeakSet()
+        self._lock = Lock()
+
+    #
+    # Engine events
+    #
+
+    def attach(self, engine):
+        """count the statements engine runs, once for each engine"""
+        engine = getattr(engine, 'sync_engine', engine)
+        with self._lock:
+            if engine in self._engines:
+                return
+            self._engines.add(engine)
+        event.listen(engine, 'before_cursor_execute', self._before_execute)
+        event.listen(engine, 'after_cursor_execute', self._after_execute)
+        event.listen(engine, 'handle_error', self._handle_error)
+
+    def detach(self, engine):
+        """stop counting the statements engine runs"""
+        engine = getattr(engine, 'sync_engine', engine)
+        with self._lock:
+            if engine not in self._engines:
+                return
+            self._engines.discard(engine)
+        event.remove(engine, 'before_cursor_execute', self._before_execute)
+        event.remove(engine, 'after_cursor_execute', self._after_execute)
+        event.remove(engine, 'handle_error', self._handle_error)
+
+    def _before_execute(self, conn, cursor, statement, parameters, context,
+                        executemany):
+        conn.info.setdefault('agora_metrics_start', []).append(perf_counter())
+
+    def _after_execute(self, conn, cursor, statement, parameters, context,
+                       executemany):
+        seconds = perf_counter() - conn.info['agora_metrics_start'].pop()
+        call = _call.get()
+        if call is not None:
+            call.statements += 1
+            call.statement_seconds += seconds
+        with self._lock:
+            self.statements.observe(seconds)
+        if self.slow_query is not None and seconds >= self.slow_query:
+            with self._lock:
+                self.slow_queries += 1
+            logger.warning('slow query: %.3fs in %s: %s', seconds,
+                           call.method if call is not None else '-',
+                           statement)
+
+    def _handle_error(self, context):
+        starts = context.connection.info.get('agora_metrics_start') \
+            if context.connection is not None else None
+        if starts:
+            starts.pop()
+
+    #
+    # Forum methods
+    #
+
+    def instrument(self, forum):
+        """time the public methods of forum, and attach its engine,
+           and the read replicas of a RoutingSession"""
+        session = forum.session
+        if isinstance(session, scoped_session):
+            session = session()
+        self.attach(session.get_bind())
+        if isinstance(session, RoutingSession):
+            replicas = session.replicas if session.replicas is not None \
+                else get_replicas()
+            for engine in replicas.engines if replicas else ():
+                self.attach(engine)
+        for name in dir(type(forum)):
+            if not name.startswith('_') and callable(
+                    getattr(type(forum), name)):
+                setattr(forum, name, self._wrap(name, getattr(forum, name)))
+
+    def _wrap(self, name, method):
+        @wraps(method)
+        def instrumented(*args, **kwargs):
+            if _call.get() is not None:
+                # count nested calls against the outer method
+                return method(*args, **kwargs)
+            call = _Call(name)
+            token = _call.set(call)
+            start = perf_counter()
+            try:
+                result = method(*args, **kwargs)
+            except Exception:
+                self._record(call, perf_counter() - start, error=True)
+                raise
+            finally:
+                _call.reset(token)
+            if isgenerator(result):
+                return self._iterate(call, result, perf_counter() - start)
+            self._record(call, perf_counter() - start)
+            return result
+        return instrumented
+
+    def _iterate(self, call, iterator, seconds):
+        """yield from iterator, counting its statements against call"""
+        error = False
+        try:
+            while True:
+                token = _call.set(call)
+                start = perf_counter()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    break
+                except Exception:
+                    error = True
+                    raise
+                finally:
+                    seconds += perf_counter() - start
+                    _call.reset(token)
+                yield item
+        finally:
+            self._record(call, seconds, error=error)
+
+    def _record(self, call, seconds, error=False):
+        with self._lock:
+            stats = self.methods.get(call.method)
+            if stats is None:
+                stats = self.methods[call.method] = _MethodStats()
+            stats.calls += 1
+            stats.errors += error
+            stats.statements += call.statements
+            stats.statement_seconds += call.statement_seconds
+            stats.seconds.observe(seconds)
+            stats.statements_per_call.observe(call.statements)
+
+    #
+    # Export
+    #
+
+    def reset(self):
+        """forget everything recorded so far"""
+        with self._lock:
+            self.statements = Histogram(seconds_buckets)
+            self.slow_queries = 0
+            self.methods = {}
+
+    def snapshot(self):
+        """return a dict of everything recorded so far"""
+        with self._lock:
+            return {'statements': self.statements.snapshot(),
+                    'slow_queries': self.slow_queries,
+                    'methods': dict((name, stats.snapshot()) for
+                                    (name, stats) in self.methods.items())}
+
+    def prometheus(self, prefix='agora'):
+        """return the snapshot in the Prometheus text exposition format"""
+        snapshot = self.snapshot()
+        methods = sorted(snapshot['methods'].items())
+        lines = []
+
+        def metric(name, kind, help):
+            lines.append('# HELP %s_%s %s' % (prefix, name, help))
+            lines.append('# TYPE %s_%s %s' % (prefix, name, kind))
+
+        def sample(name, value, labels=()):
+            label = ','.join('%s="%s"' % pair for pair in labels)
+            lines.append('%s_%s%s %s' % (prefix, name,
+                                         '{%s}' % label if label else '',
+                                         _format(value)))
+
+        def histogram(name, values, labels=()):
+            for (bound, count) in values['buckets']:
+                sample(name + '_bucket', count,
+                       labels + (('le', _format(bound)),))
+            sample(name + '_sum', values['sum'], labels)
+            sample(name + '_count', values['count'], labels)
+
+        for (name, key, help) in (
+                ('forum_calls_total', 'calls', 'Forum method calls.'),
+                ('forum_errors_total', 'errors',
+                 'Forum method calls that raised.'),
+                ('forum_statements_total', 'statements',
+                 'SQL statements run by Forum methods.'),
+                ('forum_statement_seconds_total', 'statement_seconds',
+                 'Seconds spent in SQL statements run by Forum methods.')):
+            metric(name, 'counter', help)
+            for (method, stats) in methods:
+                sample(name, stats[key], (('method', method),))
+
+        metric('forum_call_seconds', 'histogram',
+               'Forum method call latency in seconds.')
+        for (method, stats) in methods:
+            histogram('forum_call_seconds', stats['seconds'],
+                      (('method', method),))
+
+        metric('forum_call_statements', 'histogram',
+               'SQL statements per Forum method call.')
+        for (method, stats) in methods:
+            histogram('forum_call_statements', stats['statements_per_call'],
+                      (('method', method),))
+
+        metric('statement_seconds', 'histogram',
+               'SQL statement latency in seconds.')
+        histogram('statement_seconds', snapshot['statements'])
+
+        metric('slow_queries_total', 'counter',
+               'SQL statements slower than the slow query threshold.')
+        sample('slow_queries_total', snapshot['slow_queries'])
+        return '\n'.join(lines) + '\n'
+
+
+def _format(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(value)
+
+__all__ = ['Metrics', 'Histogram']
@@ -2,7 +2,7 @@
 # sqlalchemy models for agora
 #
 
-from datetime import datetime
+from datetime import datetime, timezone
 
 from sqlalchemy import (
     Column,
@@ -12,32 +12,78 @@ from sqlalchemy import (
     Sequence,
     Boolean,
     ForeignKey,
+    Index,
     UniqueConstraint
 )
 
+from sqlalchemy.ext.compiler import compiles
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.sql.expression import FunctionElement
 
 from sqlalchemy.orm import relationship
 
 Base = declarative_base()
 
 
+def utcnow():
+    """return the time in UTC, without a time zone, as timestamps are stored"""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+class current_utc(FunctionElement):
+    """the time in UTC, without a time zone, in SQL"""
+    type = DateTime()
+    inherit_cache = True
+
+
+@compiles(current_utc)
+def _current_utc(element, compiler, **kw):
+    return "CURRENT_TIMESTAMP"
+
+
+@compiles(current_utc, 'sqlite')
+def _current_utc_sqlite(element, compiler, **kw):
+    # CURRENT_TIMESTAMP is UTC on SQLite, but only to the second
+    return "(STRFTIME('%Y-%m-%d %H:%M:%f000', 'now'))"
+
+
+@compiles(current_utc, 'postgresql')
+def _current_utc_postgresql(element, compiler, **kw):
+    return "(TIMEZONE('utc', CURRENT_TIMESTAMP))"
+
+
+@compiles(current_utc, 'mysql')
+def _current_utc_mysql(element, compiler, **kw):
+    return "(UTC_TIMESTAMP(6))"
+
+
 class Mixin(object):
 
     id = Column(Integer, Sequence('idea_id_seq'), primary_key=True)
-    created = Column(DateTime, default=datetime.now())
+    # timestamps are UTC, utcnow is called for each row,
+    # and the server default covers rows inserted outside of SQLAlchemy
+    # not null, so paging by a timestamp needs no IS NULL sort key
+    created = Column(DateTime, nullable=False, default=utcnow,
+                     server_default=current_utc())
 
 
 class Idea(Mixin, Base):
     """"""
     __tablename__ = 'ideas'
+    __table_args__ = (
+        UniqueConstraint('title', 'author_id', name='unique_title'),
+        Index('ix_ideas_author_id_id', 'author_id', 'id'),
+        Index('ix_ideas_visible_created', 'visible', 'created'),
+        Index('ix_ideas_created', 'created'),
+        Index('ix_ideas_modified', 'modified'),
+    )
     title = Column(Text, nullable=False)
     idea = Column(Text, nullable=False)
     visible = Column(Boolean, default=False)
-    modified = Column(DateTime, default=datetime.now())
-    author_id = Column(Integer, ForeignKey('authors.id'), nullable=False)
-
-    UniqueConstraint('title', 'author_id', name='unique_title')
+    modified = Column(DateTime, nullable=False, default=utcnow,
+                      onupdate=utcnow, server_default=current_utc())
+    author_id = Column(Integer, ForeignKey('authors.id', ondelete='CASCADE'),
+                       nullable=False)
 
     author = relationship("Author", back_populates="ideas")
 
@@ -58,12 +104,16 @@ class Idea(Mixin, Base):
 class Author(Mixin, Base):
     """"""
     __tablename__ = 'authors'
+    __table_args__ = (
+        Index('ix_authors_created', 'created'),
+    )
     username = Column(Text, unique=True)
     fullname = Column(Text, default='Anonymous')
     email = Column(Text)
     active = Column(Boolean, default=False)
 
-    ideas = relationship("Idea", order_by=Idea.id, back_populates="author")
+    ideas = relationship("Idea", order_by=Idea.id, back_populates="author",
+                         passive_deletes=True)
 
     def __init__(self, username, fullname, email):
         self.username = username
@@ -81,4 +131,17 @@ class Author(Mixin, Base):
                 'active': str(self.active),
                 'created': str(self.created)}
 
-__all__ = ['Author', 'Idea', 'Base']
+
+class Tombstone(Mixin, Base):
+    """an idea that was deleted, and when, for Forum.changes_since"""
+    __tablename__ = 'tombstones'
+    __table_args__ = (
+        Index('ix_tombstones_created', 'created'),
+    )
+    idea_id = Column(Integer, nullable=False)
+    author_id = Column(Integer, nullable=False)
+
+    def __repr__(self):
+        return "Tombstone %s, %s" % (self.idea_id, self.created)
+
+__all__ = ['Author', 'Idea', 'Tombstone', 'Base']
@@ -0,0 +1,63 @@
+#
+# structured filters and ordering for agora queries
+#
+
+from sqlalchemy.orm.attributes import QueryableAttribute
+
+from cullerton.agora.exceptions import InvalidFilter
+
+operators = {
+    'eq': lambda column, value: column == value,
+    'ne': lambda column, value: column != value,
+    'in': lambda column, value: column.in_(value),
+    'notin': lambda column, value: ~column.in_(value),
+    'gt': lambda column, value: column > value,
+    'gte': lambda column, value: column >= value,
+    'lt': lambda column, value: column < value,
+    'lte': lambda column, value: column <= value,
+    'startswith': lambda column, value: column.startswith(
+        value, autoescape=True),
+}
+
+
+def _attribute(table, name):
+    """return the mapped attribute name of table"""
+    attribute = getattr(table, name, None)
+    if not isinstance(attribute, QueryableAttribute):
+        raise InvalidFilter(name)
+    return attribute
+
+
+def compile_filters(table, filters):
+    """return a list of criteria for table from a dict of filters
+            keys are attribute names with an optional operator suffix
+            {'author_id__in': [1, 2], 'created__gte': week_ago}
+            a key without an operator tests for equality"""
+    criteria = []
+    for (key, value) in filters.items():
+        (name, _, operator) = key.partition('__')
+        try:
+            compare = operators[operator or 'eq']
+        except KeyError:
+            raise InvalidFilter(key)
+        criteria.append(compare(_attribute(table, name), value))
+    return criteria
+
+
+def compile_order(table, order):
+    """return a list of ORDER BY clauses for table
+            order is an attribute name, prefixed with '-' for descending,
+            an SQL expression, or a list of those"""
+    if order is None:
+        return []
+    if isinstance(order, (list, tuple)):
+        clauses = []
+        for item in order:
+            clauses.extend(compile_order(table, item))
+        return clauses
+    if isinstance(order, str):
+        attribute = _attribute(table, order.lstrip('-'))
+        return [attribute.desc() if order.startswith('-') else attribute]
+    return [order]
+
+__all__ = ['compile_filters', 'compile_order']
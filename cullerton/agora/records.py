@@ -0,0 +1,86 @@
+#
+# read-only records for agora listings
+#
+
+from cullerton.agora.models import Author, Idea
+
+
+class Record(object):
+
+    """a compact read-only row
+       records are plain objects, not tracked by a session,
+       so they cost little memory and nothing at flush"""
+
+    __slots__ = ()
+
+    # the columns selected for a record, in the order of fields
+    columns = ()
+    fields = ()
+
+    def __init__(self, *values):
+        for (field, value) in zip(self.fields, values):
+            object.__setattr__(self, field, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("%s is read-only" % type(self).__name__)
+
+    def __eq__(self, other):
+        return type(other) is type(self) and all(
+            getattr(self, field) == getattr(other, field)
+            for field in self.fields)
+
+    def __hash__(self):
+        return hash((type(self), self.id))
+
+    def __repr__(self):
+        return "%s(%s)" % (type(self).__name__, ', '.join(
+            '%s=%r' % (field, getattr(self, field)) for field in self.fields))
+
+
+def _author(fullname, created):
+    # as str(author)
+    return "%s, %s" % (fullname, created.strftime("%B %d, %Y")
+                       if created else created)
+
+
+class IdeaRecord(Record):
+
+    """an idea with the username and fullname of its author"""
+
+    __slots__ = ('id', 'title', 'idea', 'visible', 'created', 'modified',
+                 'author_id', 'author_username', 'author_fullname',
+                 'author_created')
+    fields = __slots__
+    columns = (Idea.id, Idea.title, Idea.idea, Idea.visible, Idea.created,
+               Idea.modified, Idea.author_id, Author.username,
+               Author.fullname, Author.created)
+
+    def to_dict(self):
+        """return the same dict as Idea.to_dict"""
+        return {'title': self.title,
+                'idea': self.idea,
+                'author': _author(self.author_fullname, self.author_created)}
+
+
+class AuthorRecord(Record):
+
+    """an author"""
+
+    __slots__ = ('id', 'username', 'fullname', 'email', 'active', 'created')
+    fields = __slots__
+    columns = (Author.id, Author.username, Author.fullname, Author.email,
+               Author.active, Author.created)
+
+    def to_dict(self):
+        """return the same dict as Author.to_dict"""
+        return {'username': self.username,
+                'fullname': self.fullname,
+                'email': self.email,
+                'active': str(self.active),
+                'created': str(self.created)}
+
+
+# the record class for each table
+records = {Idea: IdeaRecord, Author: AuthorRecord}
+
+__all__ = ['Record', 'IdeaRecord', 'AuthorRecord']
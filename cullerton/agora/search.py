@@ -0,0 +1,242 @@
+#
+# full text search over ideas for agora
+#
+
+import re
+
+from collections import Counter
+from math import log
+from threading import Lock
+
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+from cullerton.agora.models import Idea
+
+
+def tokenize(value):
+    """return the lowercase words in value"""
+    return re.findall(r'\w+', (value or '').lower())
+
+
+class SearchIndex(object):
+    """the interface a Forum search index implements
+       the forum calls add, update, update_many, remove, and remove_author
+       after it commits a change to ideas
+       rows are dicts with id, author_id, title, and idea"""
+
+    def add(self, session, rows):
+        """index new ideas"""
+        raise NotImplementedError
+
+    def update(self, session, id, values):
+        """reindex an idea with the changed columns in values"""
+        raise NotImplementedError
+
+    def update_many(self, session, ids, values):
+        """reindex ideas that all had the columns in values changed"""
+        for id in ids:
+            self.update(session, id, values)
+
+    def remove(self, session, ids):
+        """drop ideas from the index"""
+        raise NotImplementedError
+
+    def remove_author(self, session, author_id):
+        """drop the ideas of an author from the index"""
+        raise NotImplementedError
+
+    def search(self, session, query, limit, offset=0):
+        """return ids of the ideas matching every word in query
+           best match first"""
+        raise NotImplementedError
+
+    def rebuild(self, session):
+        """rebuild the index from the ideas table
+           the forum commits when the index writes to the database"""
+        raise NotImplementedError
+
+
+class FTS5Index(SearchIndex):
+
+    """an SQLite FTS5 index on the ideas table
+       triggers keep it current inside the same transaction as each write,
+       so add, update, remove, and remove_author have nothing to do"""
+
+    statements = (
+        "CREATE VIRTUAL TABLE IF NOT EXISTS ideas_fts USING fts5("
+        "title, idea, content='ideas', content_rowid='id')",
+        "CREATE TRIGGER IF NOT EXISTS ideas_fts_insert "
+        "AFTER INSERT ON ideas BEGIN "
+        "INSERT INTO ideas_fts(rowid, title, idea) "
+        "VALUES (new.id, new.title, new.idea); END",
+        "CREATE TRIGGER IF NOT EXISTS ideas_fts_delete "
+        "AFTER DELETE ON ideas BEGIN "
+        "INSERT INTO ideas_fts(ideas_fts, rowid, title, idea) "
+        "VALUES ('delete', old.id, old.title, old.idea); END",
+        "CREATE TRIGGER IF NOT EXISTS ideas_fts_update "
+        "AFTER UPDATE OF title, idea ON ideas BEGIN "
+        "INSERT INTO ideas_fts(ideas_fts, rowid, title, idea) "
+        "VALUES ('delete', old.id, old.title, old.idea); "
+        "INSERT INTO ideas_fts(rowid, title, idea) "
+        "VALUES (new.id, new.title, new.idea); END",
+    )
+
+    def create(self, session):
+        """create the index and its triggers, then fill the index"""
+        for statement in self.statements:
+            session.execute(text(statement))
+        self.rebuild(session)
+        session.commit()
+
+    def add(self, session, rows):
+        pass
+
+    def update(self, session, id, values):
+        pass
+
+    def update_many(self, session, ids, values):
+        pass
+
+    def remove(self, session, ids):
+        pass
+
+    def remove_author(self, session, author_id):
+        pass
+
+    def search(self, session, query, limit, offset=0):
+        words = tokenize(query)
+        if not words:
+            return []
+        # quote every word so query syntax in the text is taken literally
+        match = ' '.join('"%s"' % word for word in words)
+        result = session.execute(text(
+            "SELECT rowid FROM ideas_fts WHERE ideas_fts MATCH :match "
+            "ORDER BY rank, rowid LIMIT :limit OFFSET :offset"),
+            {'match': match, 'limit': limit, 'offset': offset})
+        return [row[0] for row in result]
+
+    def rebuild(self, session):
+        session.execute(text(
+            "INSERT INTO ideas_fts(ideas_fts) VALUES ('rebuild')"))
+
+
+class MemoryIndex(SearchIndex):
+
+    """an in-process inverted index of idea titles and text
+       results are ranked by tf-idf"""
+
+    def __init__(self):
+        self.postings = {}
+        self.documents = {}
+        self.authors = {}
+        self._lock = Lock()
+
+    def _add(self, id, author_id, words):
+        self.documents[id] = (author_id, words)
+        self.authors.setdefault(author_id, set()).add(id)
+        for (word, count) in words.items():
+            self.postings.setdefault(word, {})[id] = count
+
+    def _remove(self, id):
+        try:
+            (author_id, words) = self.documents.pop(id)
+        except KeyError:
+            return
+        self.authors.get(author_id, set()).discard(id)
+        for word in words:
+            postings = self.postings[word]
+            del postings[id]
+            if not postings:
+                del self.postings[word]
+
+    def add(self, session, rows):
+        with self._lock:
+            for row in rows:
+                self._remove(row['id'])
+                self._add(row['id'], row['author_id'], Counter(
+                    tokenize(row['title']) + tokenize(row['idea'])))
+
+    def update(self, session, id, values):
+        if not set(values) & set(('title', 'idea', 'author_id')):
+            return
+        # we only have the words, so read the idea again
+        row = session.query(
+            Idea.id, Idea.author_id, Idea.title, Idea.idea).filter_by(
+            id=id).first()
+        with self._lock:
+            self._remove(id)
+            if row is not None:
+                self._add(row.id, row.author_id, Counter(
+                    tokenize(row.title) + tokenize(row.idea)))
+
+    def update_many(self, session, ids, values):
+        if not set(values) & set(('title', 'idea', 'author_id')):
+            return
+        ids = list(ids)
+        rows = []
+        for start in range(0, len(ids), 500):
+            rows.extend(session.query(
+                Idea.id, Idea.author_id, Idea.title, Idea.idea).filter(
+                Idea.id.in_(ids[start:start + 500])))
+        with self._lock:
+            for id in ids:
+                self._remove(id)
+            for row in rows:
+                self._add(row.id, row.author_id, Counter(
+                    tokenize(row.title) + tokenize(row.idea)))
+
+    def remove(self, session, ids):
+        with self._lock:
+            for id in ids:
+                self._remove(id)
+
+    def remove_author(self, session, author_id):
+        with self._lock:
+            for id in list(self.authors.pop(author_id, ())):
+                self._remove(id)
+
+    def search(self, session, query, limit, offset=0):
+        words = set(tokenize(query))
+        with self._lock:
+            postings = [self.postings.get(word, {}) for word in words]
+            if not postings or not all(postings):
+                return []
+            postings.sort(key=len)
+            ids = set(postings[0]).intersection(*postings[1:])
+            total = len(self.documents)
+            scores = dict((id, sum(
+                posting[id] * log(1.0 + total / len(posting))
+                for posting in postings)) for id in ids)
+        ranked = sorted(ids, key=lambda id: (-scores[id], id))
+        return ranked[offset:offset + limit]
+
+    def rebuild(self, session):
+        rows = session.query(
+            Idea.id, Idea.author_id, Idea.title, Idea.idea).yield_per(1000)
+        with self._lock:
+            self.postings = {}
+            self.documents = {}
+            self.authors = {}
+            for row in rows:
+                self._add(row.id, row.author_id, Counter(
+                    tokenize(row.title) + tokenize(row.idea)))
+
+
+def create_index(session):
+    """return a filled search index for the database of session
+       FTS5 when the database is SQLite and has it
+       an in-process MemoryIndex otherwise"""
+    if session.get_bind().dialect.name == 'sqlite':
+        index = FTS5Index()
+        try:
+            index.create(session)
+        except OperationalError:
+            session.rollback()
+        else:
+            return index
+    index = MemoryIndex()
+    index.rebuild(session)
+    return index
+
+__all__ = ['SearchIndex', 'FTS5Index', 'MemoryIndex', 'create_index']
@@ -1,8 +1,84 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import scoped_session, sessionmaker
+import os
 
-engine = create_engine('sqlite:///agora.sqlite')
-DBSession = scoped_session(sessionmaker())
-DBSession.configure(bind=engine)
+from time import monotonic
 
-__all__ = ['DBSession']
+from sqlalchemy import event
+from sqlalchemy.orm import Session, scoped_session, sessionmaker
+
+from .engine import get_engine, get_replicas
+
+
+class LazySession(Session):
+
+    """a session bound to the configured engine on first use
+       unless it was given a bind"""
+
+    def get_bind(self, *args, **kwargs):
+        if self.bind is None:
+            self.bind = get_engine()
+        return super(LazySession, self).get_bind(*args, **kwargs)
+
+
+class RoutingSession(LazySession):
+
+    """a session that sends reads to read replicas
+            replicas is an engine.ReplicaSet, the configured replicas
+            by default, see engine.get_replicas
+
+       writes, and reads that are not plain SELECTs, go to the bind
+       so do reads inside Forum.transaction, reads in a transaction
+       that has written, and reads for sticky seconds after a write
+       commits, so the session reads its own writes
+       each transaction reads from one replica"""
+
+    def __init__(self, replicas=None, sticky=1.0, **kwargs):
+        super(RoutingSession, self).__init__(**kwargs)
+        self.replicas = replicas
+        self.sticky = sticky
+        self._replica = None
+        self._writing = False
+        self._written = None
+
+    def _read_from_primary(self):
+        if self.info.get('agora_scopes') or self._writing:
+            return True
+        return self._written is not None and \
+            monotonic() - self._written < self.sticky
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        if self._flushing or (clause is not None and clause.is_dml):
+            self._writing = True
+        elif clause is not None and clause.is_select and \
+                getattr(clause, '_for_update_arg', None) is None and \
+                not self._read_from_primary():
+            if self._replica is None:
+                replicas = self.replicas if self.replicas is not None \
+                    else get_replicas()
+                if replicas:
+                    self._replica = replicas.choose()
+            if self._replica is not None:
+                return self._replica
+        return super(RoutingSession, self).get_bind(
+            mapper=mapper, clause=clause, **kwargs)
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def _after_commit(session):
+    if session._writing:
+        session._written = monotonic()
+
+
+@event.listens_for(RoutingSession, 'after_transaction_end')
+def _after_transaction_end(session, transaction):
+    if transaction.parent is None:
+        session._replica = None
+        session._writing = False
+
+
+DBSession = scoped_session(sessionmaker(class_=RoutingSession))
+
+if hasattr(os, 'register_at_fork'):
+    # a forked child must not use the parent's session, or its connection
+    os.register_at_fork(after_in_child=DBSession.registry.clear)
+
+__all__ = ['DBSession', 'RoutingSession']
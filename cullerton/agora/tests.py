@@ -4,6 +4,12 @@ from logging import getLogger
 logger = getLogger(__name__)
 
 
+def _installed(*names):
+    """return whether the modules names can be imported"""
+    from importlib.util import find_spec
+    return all(find_spec(name) is not None for name in names)
+
+
 def _populate_test_db(session):
     from cullerton.agora.models import Author, Idea
 
@@ -22,15 +28,19 @@ def _populate_test_db(session):
         for idea in range(1, 4)]
         for author_id in range(1, session.query(Author).count() + 1)]
 
+    session.commit()
+
 
 def _initialize_test_db():
 
+    from cullerton.agora.engine import sqlite_transactions
     from cullerton.agora.models import Base
 
     from sqlalchemy import create_engine
     from sqlalchemy.orm import scoped_session, sessionmaker
 
     engine = create_engine('sqlite:///:memory:')
+    sqlite_transactions(engine)
     Base.metadata.create_all(engine)
 
     DBSession = scoped_session(sessionmaker())
@@ -53,6 +63,23 @@ class AgoraBase(unittest.TestCase):
         from cullerton.agora import Forum
         return Forum(self.session)
 
+    def _statements(self, call, *args, **kwargs):
+        """return the SQL statements executed by call"""
+        from sqlalchemy import event
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        engine = self.session.get_bind()
+        event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            call(*args, **kwargs)
+        finally:
+            event.remove(
+                engine, 'before_cursor_execute', before_cursor_execute)
+        return statements
+
 
 class AgoraSessionTests(unittest.TestCase):
 
@@ -67,6 +94,94 @@ class AgoraSessionTests(unittest.TestCase):
         with self.assertRaises(InvalidSession):
             Forum(DBSession)
 
+    def test_missing_columns_and_indexes(self):
+        from cullerton.agora import Forum
+        from cullerton.agora.exceptions import InvalidSession
+        from cullerton.agora.models import Base
+        from sqlalchemy import create_engine
+        from sqlalchemy.orm import scoped_session, sessionmaker
+
+        engine = create_engine('sqlite:///:memory:')
+        Base.metadata.create_all(engine)
+        engine.execute('DROP INDEX ix_ideas_created')
+        DBSession = scoped_session(sessionmaker(bind=engine))
+        with self.assertRaises(InvalidSession):
+            Forum(DBSession)
+
+        # a forum can skip validation
+        Forum(DBSession, validate=False)
+
+        engine.execute('ALTER TABLE authors RENAME TO old_authors')
+        engine.execute('CREATE TABLE authors (id INTEGER PRIMARY KEY)')
+        with self.assertRaises(InvalidSession):
+            Forum(DBSession)
+
+    def test_validation_is_cached(self):
+        """should only inspect the database for the first forum"""
+        from cullerton.agora import Forum
+        from cullerton.agora.agora import validate_schema
+        from sqlalchemy import event
+        session = _initialize_test_db()
+        engine = session.get_bind()
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+        Forum(session)
+        self.assertNotEqual(statements, [])
+        del statements[:]
+        Forum(session)
+        validate_schema(engine)
+        self.assertEqual(statements, [])
+        validate_schema(engine, cache=False)
+        self.assertNotEqual(statements, [])
+
+    def test_initialize_old_database(self):
+        """should add the tables and indexes missing from an old database"""
+        import os
+        import tempfile
+        from cullerton.agora.agora import validate_schema
+        from cullerton.agora.exceptions import InvalidSession
+        from cullerton.agora.initialize_db import main
+        from cullerton.agora.session import DBSession
+        from sqlalchemy import create_engine, inspect
+        from sqlalchemy.exc import IntegrityError
+
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        url = 'sqlite:///%s' % os.path.join(directory.name, 'agora.sqlite')
+        engine = create_engine(url)
+        self.addCleanup(engine.dispose)
+        engine.execute('CREATE TABLE authors (id INTEGER PRIMARY KEY, '
+                       'created DATETIME, username VARCHAR(255) UNIQUE, '
+                       'fullname VARCHAR(255), email VARCHAR(255), '
+                       'active BOOLEAN)')
+        engine.execute('CREATE TABLE ideas (id INTEGER PRIMARY KEY, '
+                       'created DATETIME, title VARCHAR(255), idea TEXT, '
+                       'visible BOOLEAN, modified DATETIME, '
+                       'author_id INTEGER NOT NULL REFERENCES authors (id))')
+        with self.assertRaises(InvalidSession):
+            validate_schema(engine, cache=False)
+
+        self.addCleanup(DBSession.configure, bind=None)
+        self.addCleanup(DBSession.remove)
+        main(['initialize_agora_db', url])
+        validate_schema(engine, cache=False)
+        indexes = inspect(engine).get_indexes('ideas')
+        self.assertIn('unique_title', [index['name'] for index in indexes])
+
+        # a second run changes nothing
+        main(['initialize_agora_db', url])
+        validate_schema(engine, cache=False)
+
+        engine.execute("INSERT INTO authors (id, username) VALUES (1, 'a')")
+        engine.execute("INSERT INTO ideas (title, author_id) VALUES ('t', 1)")
+        with self.assertRaises(IntegrityError):
+            engine.execute(
+                "INSERT INTO ideas (title, author_id) VALUES ('t', 1)")
+
 
 class AgoraAuthorTests(AgoraBase):
 
@@ -125,6 +240,22 @@ class AgoraAuthorTests(AgoraBase):
         for id in range(1, forum.get_author_count()):
             self.assertIn("User %s" % id, forum.get_author(id).__repr__())
 
+    def test_iter_authors(self):
+        forum = self._Forum()
+        authors = list(forum.iter_authors(batch_size=1))
+        self.assertEqual(len(authors), forum.get_author_count())
+
+    def test_get_authors_page(self):
+        """should return a page of authors and a cursor"""
+        forum = self._Forum()
+
+        (page, cursor) = forum.get_authors_page(limit=1, order='-id')
+        self.assertEqual([author.id for author in page], [2])
+        (page, cursor) = forum.get_authors_page(
+            limit=1, cursor=cursor, order='-id')
+        self.assertEqual([author.id for author in page], [1])
+        self.assertIsNone(cursor)
+
     def test_add_author(self):
         forum = self._Forum()
 
@@ -138,6 +269,17 @@ class AgoraAuthorTests(AgoraBase):
         test_author = forum.get_author(new_author_id)
         self.assertEqual(username, test_author.username)
 
+    def test_add_duplicate_author(self):
+        from cullerton.agora.exceptions import DuplicateAuthor
+        forum = self._Forum()
+        author_count = forum.get_author_count()
+
+        with self.assertRaises(DuplicateAuthor):
+            forum.add_author(username='user_1', fullname='User 1',
+                             email='user_1@example.com')
+        self.assertEqual(forum.get_author_count(), author_count)
+        self.assertEqual(forum.get_author(1).username, 'user_1')
+
     def test_add_author_fail(self):
         from cullerton.agora.exceptions import AddAuthor
         forum = self._Forum()
@@ -150,6 +292,41 @@ class AgoraAuthorTests(AgoraBase):
                              fullname=fullname,
                              email=email)
 
+    def test_add_authors(self):
+        """should return new ids in input order, None for duplicates"""
+        forum = self._Forum()
+        author_count = forum.get_author_count()
+        authors = [{'username': 'bulk_%s' % i,
+                    'fullname': 'Bulk %s' % i,
+                    'email': 'bulk_%s@example.com' % i} for i in range(5)]
+        authors.insert(2, {'username': 'user_1', 'fullname': 'User 1',
+                           'email': 'user_1@example.com'})
+        authors.append(authors[0])
+
+        ids = forum.add_authors(authors, chunk_size=2)
+
+        self.assertEqual(len(ids), len(authors))
+        self.assertIsNone(ids[2])
+        self.assertIsNone(ids[-1])
+        self.assertEqual(forum.get_author_count(), author_count + 5)
+        for (author, id) in zip(authors, ids):
+            if id is not None:
+                self.assertEqual(
+                    forum.get_author(id).username, author['username'])
+
+    def test_add_authors_fail(self):
+        """should add none of the authors"""
+        from cullerton.agora.exceptions import AddAuthor
+        forum = self._Forum()
+        author_count = forum.get_author_count()
+        authors = [{'username': 'bulk_1', 'fullname': 'Bulk 1',
+                    'email': 'bulk_1@example.com'},
+                   {'username': '', 'fullname': 'Bulk Fail',
+                    'email': 'bulk_fail@example.com'}]
+        with self.assertRaises(AddAuthor):
+            forum.add_authors(authors, chunk_size=1)
+        self.assertEqual(forum.get_author_count(), author_count)
+
     def test_edit_author(self):
         forum = self._Forum()
         author_count = forum.get_author_count()
@@ -189,6 +366,28 @@ class AgoraAuthorTests(AgoraBase):
         for id in range(1, author_count):
             self.assertEqual(forum.delete_author(id), id)
 
+    def test_delete_author_ideas(self):
+        """should return the number of ideas deleted"""
+        forum = self._Forum()
+        idea_count = forum.get_idea_count()
+
+        self.assertEqual(forum.delete_author_ideas(1), 3)
+        self.assertEqual(forum.get_idea_count(), idea_count - 3)
+        self.assertEqual(forum.get_ideas(filters={'author_id': 1}), [])
+        self.assertEqual(forum.delete_author_ideas(1), 0)
+
+    def test_delete_author_cascade(self):
+        """should delete the author and ideas with two statements
+           and record the tombstones of the ideas with a third"""
+        forum = self._Forum()
+        idea_count = forum.get_idea_count()
+
+        statements = self._statements(forum.delete_author, 2)
+        self.assertEqual(len(statements), 3)
+        self.assertTrue(statements[0].startswith('INSERT INTO tombstones'))
+        self.assertIsNone(forum.get_author(2))
+        self.assertEqual(forum.get_idea_count(), idea_count - 3)
+
     def test_delete_bad_author(self):
         forum = self._Forum()
         author_count = forum.get_author_count()
@@ -259,6 +458,149 @@ class AgoraIdeaTests(AgoraBase):
             self.assertRegexpMatches(
                 forum.get_idea(id).__repr__(), 'Idea \d+, User \d+')
 
+    def test_iter_ideas(self):
+        """should yield the same ideas as get_ideas, then expunge them"""
+        forum = self._Forum()
+        ideas = [idea.id for idea in forum.get_ideas(order='title')]
+        self.session.expunge_all()
+
+        seen = []
+        for idea in forum.iter_ideas(order='title', batch_size=2):
+            self.assertIn(idea, self.session)
+            seen.append(idea)
+        self.assertEqual([idea.id for idea in seen], ideas)
+        for idea in seen:
+            self.assertNotIn(idea, self.session)
+
+    def test_iter_eager_loads(self):
+        """should stream with every load strategy"""
+        forum = self._Forum()
+        for load in ('lazy', 'joined', 'selectin', 'subquery'):
+            self.assertEqual(
+                [len(author.ideas) for author in forum.iter_authors(
+                    load=load, batch_size=1)], [3, 3])
+            self.assertEqual(
+                [idea.author.id for idea in forum.iter_ideas(
+                    load=load, batch_size=4)], [1, 1, 1, 2, 2, 2])
+            self.session.remove()
+
+    def test_iter_ideas_with_filters(self):
+        forum = self._Forum()
+        filters = {'author_id': 1}
+        self.assertEqual(
+            [idea.id for idea in forum.iter_ideas(filters=filters, limit=2)],
+            [idea.id for idea in forum.get_ideas(filters=filters, limit=2)])
+
+    def test_get_ideas_page(self):
+        """should walk every idea once, in order, a page at a time"""
+        forum = self._Forum()
+        idea_count = forum.get_idea_count()
+
+        for order in ('id', '-id', 'title', '-created'):
+            ideas = []
+            (page, cursor) = forum.get_ideas_page(limit=4, order=order)
+            ideas.extend(page)
+            while cursor:
+                (page, cursor) = forum.get_ideas_page(
+                    limit=4, cursor=cursor, order=order)
+                self.assertLessEqual(len(page), 4)
+                ideas.extend(page)
+            self.assertEqual(len(ideas), idea_count)
+            self.assertEqual(len(set(idea.id for idea in ideas)), idea_count)
+
+        (page, cursor) = forum.get_ideas_page(limit=2, order='title')
+        (page, cursor) = forum.get_ideas_page(
+            limit=2, cursor=cursor, order='title')
+        self.assertEqual([(idea.title, idea.author_id) for idea in page],
+                         [('Idea 2', 1), ('Idea 2', 2)])
+
+    def _walk_pages(self, get_page, order, limit=2):
+        items = []
+        (page, cursor) = get_page(limit=limit, order=order)
+        items.extend(page)
+        while cursor:
+            (page, cursor) = get_page(limit=limit, cursor=cursor, order=order)
+            items.extend(page)
+        return items
+
+    def test_get_ideas_page_booleans_and_nulls(self):
+        """should page on booleans and NULLs, NULLs last"""
+        forum = self._Forum()
+        forum.edit_ideas({'visible': True}, ids=[2, 5])
+        forum.edit_ideas({'visible': None}, ids=[3])
+        ideas = self._walk_pages(forum.get_ideas_page, 'visible')
+        self.assertEqual([(idea.visible, idea.id) for idea in ideas], [
+            (False, 1), (False, 4), (False, 6), (True, 2), (True, 5),
+            (None, 3)])
+        ideas = self._walk_pages(forum.get_ideas_page, '-visible')
+        self.assertEqual([idea.id for idea in ideas], [3, 5, 2, 6, 4, 1])
+
+    def test_get_authors_page_nulls(self):
+        forum = self._Forum()
+        forum.add_author('user_3', 'User 3', None)
+        forum.add_author('user_4', 'User 4', 'a@example.com')
+        for (order, ids) in (('email', [4, 1, 2, 3]),
+                             ('-email', [3, 2, 1, 4])):
+            authors = self._walk_pages(forum.get_authors_page, order, limit=1)
+            self.assertEqual([author.id for author in authors], ids)
+
+    def test_get_ideas_page_plan(self):
+        """should read the pages of a timestamp in index order, unsorted"""
+        from sqlalchemy import event
+        forum = self._Forum()
+        engine = self.session.get_bind()
+        for (order, index) in (('created', 'ix_ideas_created'),
+                               ('-created', 'ix_ideas_created'),
+                               ('modified', 'ix_ideas_modified')):
+            statements = []
+
+            def before_cursor_execute(conn, cursor, statement, parameters,
+                                      *args):
+                statements.append((statement, parameters))
+
+            event.listen(
+                engine, 'before_cursor_execute', before_cursor_execute)
+            try:
+                (page, cursor) = forum.get_ideas_page(limit=2, order=order)
+                forum.get_ideas_page(limit=2, cursor=cursor, order=order)
+            finally:
+                event.remove(
+                    engine, 'before_cursor_execute', before_cursor_execute)
+            self.assertEqual(len(statements), 2)
+            for (statement, parameters) in statements:
+                plan = ' '.join(row[-1] for row in engine.execute(
+                    'EXPLAIN QUERY PLAN ' + statement, parameters))
+                self.assertIn(index, plan)
+                self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_get_ideas_page_bad_order(self):
+        from cullerton.agora.exceptions import InvalidFilter
+        forum = self._Forum()
+        for order in ('nothing', 'author', '-ideas'):
+            with self.assertRaises(InvalidFilter):
+                forum.get_ideas_page(order=order)
+
+    def test_get_ideas_page_with_filters(self):
+        """should only page through the filtered ideas"""
+        forum = self._Forum()
+        filters = {'author_id': 2}
+
+        (page, cursor) = forum.get_ideas_page(filters=filters, limit=2)
+        self.assertEqual([idea.id for idea in page], [4, 5])
+        (page, cursor) = forum.get_ideas_page(
+            filters=filters, limit=2, cursor=cursor)
+        self.assertEqual([idea.id for idea in page], [6])
+        self.assertIsNone(cursor)
+
+    def test_get_ideas_page_bad_cursor(self):
+        from cullerton.agora.exceptions import InvalidCursor
+        forum = self._Forum()
+        (page, cursor) = forum.get_ideas_page(limit=1, order='title')
+
+        for bad_cursor in ('not a cursor', cursor):
+            with self.assertRaises(InvalidCursor):
+                forum.get_ideas_page(cursor=bad_cursor, order='id')
+
     def test_add_idea(self):
         forum = self._Forum()
 
@@ -273,6 +615,27 @@ class AgoraIdeaTests(AgoraBase):
         self.assertEqual(title, test_idea.title)
         self.assertEqual(idea, test_idea.idea)
 
+    def test_add_duplicate_idea(self):
+        from cullerton.agora.exceptions import DuplicateIdea
+        forum = self._Forum()
+        idea_count = forum.get_idea_count()
+
+        forum.add_idea(title='New Idea', idea='This is new.', author_id=1)
+        with self.assertRaises(DuplicateIdea):
+            forum.add_idea(title='New Idea', idea='Again', author_id=1)
+        self.assertEqual(forum.get_idea_count(), idea_count + 1)
+
+        # another author may use the same title
+        forum.add_idea(title='New Idea', idea='Mine', author_id=2)
+        self.assertEqual(forum.get_idea_count(), idea_count + 2)
+
+    def test_add_idea_bad_author(self):
+        from cullerton.agora.exceptions import AddIdea
+        forum = self._Forum()
+        with self.assertRaises(AddIdea):
+            forum.add_idea(title='My Test Title', idea='My test idea',
+                           author_id=forum.get_author_count() + 1)
+
     def test_add_idea_fail(self):
         from cullerton.agora.exceptions import AddIdea
         forum = self._Forum()
@@ -285,18 +648,60 @@ class AgoraIdeaTests(AgoraBase):
                            idea=idea,
                            author_id=author_id)
 
+    def test_add_ideas(self):
+        """should return new ids in input order, None for duplicates"""
+        forum = self._Forum()
+        idea_count = forum.get_idea_count()
+        ideas = [{'title': 'Bulk %s' % i,
+                  'idea': 'This is bulk idea %s' % i,
+                  'author_id': i % 2 + 1} for i in range(7)]
+        ideas.insert(3, {'title': 'Idea 1', 'idea': 'duplicate',
+                         'author_id': 2})
+
+        ids = forum.add_ideas(ideas, chunk_size=3)
+
+        self.assertEqual(len(ids), len(ideas))
+        self.assertIsNone(ids[3])
+        self.assertEqual(forum.get_idea_count(), idea_count + 7)
+        for (idea, id) in zip(ideas, ids):
+            if id is not None:
+                test_idea = forum.get_idea(id)
+                self.assertEqual(test_idea.title, idea['title'])
+                self.assertEqual(test_idea.author_id, idea['author_id'])
+
+    def test_add_ideas_bad_author(self):
+        """should add none of the ideas"""
+        from cullerton.agora.exceptions import InvalidAuthor
+        forum = self._Forum()
+        idea_count = forum.get_idea_count()
+        ideas = [{'title': 'Bulk 1', 'idea': 'This is bulk idea 1',
+                  'author_id': 1},
+                 {'title': 'Bulk 2', 'idea': 'This is bulk idea 2',
+                  'author_id': forum.get_author_count() + 1}]
+        with self.assertRaises(InvalidAuthor):
+            forum.add_ideas(ideas)
+        self.assertEqual(forum.get_idea_count(), idea_count)
+
     def test_edit_idea(self):
         forum = self._Forum()
         idea_count = forum.get_idea_count()
 
         for id in range(1, idea_count):
 
-            forum.edit_idea(id, title='Edited Title',
+            # titles are unique for each author
+            forum.edit_idea(id, title='Edited Title %s' % id,
                             idea='This is the edited idea.')
             test_idea = forum.get_idea(id)
-            self.assertEqual('Edited Title', test_idea.title)
+            self.assertEqual('Edited Title %s' % id, test_idea.title)
             self.assertEqual('This is the edited idea.', test_idea.idea)
 
+    def test_edit_idea_duplicate_title(self):
+        from cullerton.agora.exceptions import EditIdea
+        forum = self._Forum()
+        with self.assertRaises(EditIdea):
+            forum.edit_idea(1, title='Idea 2')
+        self.assertEqual(forum.get_idea(1).title, 'Idea 1')
+
     def test_edit_bad_idea(self):
         forum = self._Forum()
         idea_count = forum.get_idea_count()
@@ -314,6 +719,51 @@ class AgoraIdeaTests(AgoraBase):
         for id in range(1, idea_count):
             self.assertEqual(forum.delete_idea(id), id)
 
+    def test_write_statements(self):
+        """writes should not query again to check their own work"""
+        forum = self._Forum()
+
+        # the author of the idea comes with the tombstone,
+        # from a SELECT where INSERT ... RETURNING is not supported
+        statements = self._statements(forum.delete_idea, 1)
+        self.assertEqual(len(statements), 3)
+        self.assertTrue(statements[0].startswith('SELECT'))
+        self.assertTrue(statements[1].startswith('INSERT INTO tombstones'))
+        self.assertTrue(statements[2].startswith('DELETE'))
+
+        statements = self._statements(forum.edit_idea, 2, title='Edited')
+        self.assertEqual(len(statements), 2)
+
+        statements = self._statements(
+            forum.add_author, 'new_user', 'New User', 'new@example.com')
+        self.assertEqual(len(statements), 1)
+
+        statements = self._statements(
+            forum.add_idea, 'New Idea', 'This is new.', 1)
+        self.assertEqual(len(statements), 2)
+
+    def test_add_idea_not_null(self):
+        """a NOT NULL violation is not a duplicate"""
+        from cullerton.agora.exceptions import AddIdea, DuplicateIdea
+        forum = self._Forum()
+        with self.assertRaises(AddIdea):
+            forum.add_idea('Empty Idea', None, 1)
+        with self.assertRaises(DuplicateIdea):
+            forum.add_idea('Idea 1', 'Again', 1)
+
+    def test_add_idea_locked(self):
+        """database errors other than integrity errors should propagate,
+           so callers can tell them from bad input and retry"""
+        from unittest import mock
+        from sqlalchemy.exc import OperationalError
+        forum = self._Forum()
+        error = OperationalError('INSERT', {}, Exception('database is locked'))
+        with mock.patch.object(self.session(), 'flush', side_effect=error):
+            with self.assertRaises(OperationalError):
+                forum.add_idea('Locked Idea', 'This is locked.', 1)
+        self.assertEqual(len(forum.get_ideas(
+            filters={'title': 'Locked Idea'})), 0)
+
     def test_delete_bad_idea(self):
         forum = self._Forum()
         idea_count = forum.get_idea_count()
@@ -322,3 +772,1330 @@ class AgoraIdeaTests(AgoraBase):
         for id in (-1, 0, idea_count + 1):
             with self.assertRaises(InvalidIdea):
                 forum.delete_idea(id)
+
+
+class AgoraCacheTests(AgoraBase):
+
+    def _Forum(self):
+        from cullerton.agora import Forum
+        from cullerton.agora.cache import LRUCache
+        return Forum(self.session, cache=LRUCache(maxsize=4))
+
+    def test_get_idea_dict(self):
+        """should read through the cache"""
+        forum = self._Forum()
+
+        idea = forum.get_idea_dict(1)
+        self.assertEqual(idea, forum.get_idea(1).to_dict())
+        self.assertEqual(self._statements(forum.get_idea_dict, 1), [])
+        self.assertEqual(forum.cache.stats()['hits'], 1)
+        self.assertEqual(forum.cache.stats()['misses'], 1)
+
+    def test_get_bad_idea_dict(self):
+        """should return None"""
+        forum = self._Forum()
+        self.assertIsNone(forum.get_idea_dict(forum.get_idea_count() + 1))
+
+    def test_edit_idea_invalidates(self):
+        forum = self._Forum()
+        forum.get_idea_dict(1)
+        forum.edit_idea(1, title='Edited Title')
+        self.assertEqual(forum.get_idea_dict(1)['title'], 'Edited Title')
+
+    def test_delete_idea_invalidates(self):
+        forum = self._Forum()
+        forum.get_idea_dict(1)
+        forum.delete_idea(1)
+        self.assertIsNone(forum.get_idea_dict(1))
+
+    def test_edit_author_invalidates(self):
+        """should also invalidate the author ideas"""
+        forum = self._Forum()
+        forum.get_author_dict(1)
+        forum.get_idea_dict(1)
+        forum.edit_author(1, fullname='Edited User')
+        self.assertEqual(forum.get_author_dict(1)['fullname'], 'Edited User')
+        self.assertIn('Edited User', forum.get_idea_dict(1)['author'])
+
+    def test_delete_author_invalidates(self):
+        forum = self._Forum()
+        forum.get_author_dict(1)
+        forum.get_idea_dict(1)
+        forum.delete_author(1)
+        self.assertIsNone(forum.get_author_dict(1))
+        self.assertIsNone(forum.get_idea_dict(1))
+
+    def test_lru_eviction(self):
+        from cullerton.agora.cache import LRUCache
+        cache = LRUCache(maxsize=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+    def test_lru_ttl(self):
+        from cullerton.agora.cache import LRUCache
+        cache = LRUCache(ttl=-1)
+        cache.set('a', 1)
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.stats()['size'], 0)
+
+
+class AgoraCountTests(AgoraBase):
+
+    def test_get_idea_count_cached(self):
+        """should only query the database the first time"""
+        forum = self._Forum()
+        self.assertEqual(forum.get_idea_count(), 6)
+        self.assertEqual(self._statements(forum.get_idea_count), [])
+
+    def test_counts_follow_writes(self):
+        forum = self._Forum()
+        forum.get_author_count()
+        forum.get_idea_count()
+        for id in (1, 2):
+            forum.get_author_idea_count(id)
+
+        new_author_id = forum.add_author('counted', 'Counted', 'c@example.com')
+        forum.add_idea('Counted Idea', 'This is counted.', new_author_id)
+        forum.add_ideas([{'title': 'Bulk %s' % i, 'idea': 'Bulk idea',
+                          'author_id': 1} for i in range(3)])
+        forum.delete_author(2)
+
+        statements = self._statements(
+            lambda: (forum.get_author_count(), forum.get_idea_count(),
+                     forum.get_author_idea_count(new_author_id)))
+        self.assertEqual(statements, [])
+
+        forum.delete_idea(1)
+        statements = self._statements(
+            lambda: (forum.get_idea_count(), forum.get_author_idea_count(1)))
+        self.assertEqual(statements, [])
+        self.assertEqual(forum.get_author_count(), 2)
+        self.assertEqual(forum.get_idea_count(), 6)
+        self.assertEqual(forum.get_author_idea_count(new_author_id), 1)
+        self.assertEqual(forum.get_author_idea_count(1), 5)
+        self.assertEqual(forum.get_author_idea_count(2), 0)
+
+    def test_counts_expire(self):
+        """writes by another forum should show once the counts expire"""
+        import time
+        from cullerton.agora import Forum
+        from cullerton.agora.counts import Counts
+        first = Forum(self.session, counts=Counts(ttl=0.1))
+        second = Forum(self.session, counts=Counts(ttl=0.1))
+        self.assertEqual(first.get_idea_count(), 6)
+        self.assertEqual(first.get_author_idea_count(1), 3)
+        second.add_idea('Elsewhere', 'Added by another forum.', 1)
+        self.assertEqual(first.get_idea_count(), 6)
+        time.sleep(0.2)
+        self.assertEqual(first.get_idea_count(), 7)
+        self.assertEqual(first.get_author_idea_count(1), 4)
+
+    def test_counts_shared(self):
+        from cullerton.agora import Forum
+        from cullerton.agora.counts import Counts
+        counts = Counts()
+        first = Forum(self.session, counts=counts)
+        second = Forum(self.session, counts=counts)
+        self.assertEqual(first.get_idea_count(), 6)
+        second.add_idea('Shared', 'Counted once for both forums.', 1)
+        self.assertEqual(self._statements(first.get_idea_count), [])
+        self.assertEqual(first.get_idea_count(), 7)
+
+    def test_reconcile_counts(self):
+        from cullerton.agora.models import Author
+        forum = self._Forum()
+        forum.get_author_count()
+        forum.get_author_idea_count(1)
+
+        # a write behind the back of the forum
+        self.session.add(Author('user_3', 'User 3', 'user_3@example.com'))
+        self.session.commit()
+        self.assertEqual(forum.get_author_count(), 2)
+
+        forum.reconcile_counts()
+        self.assertEqual(self._statements(forum.get_author_idea_count, 3), [])
+        self.assertEqual(forum.get_author_count(), 3)
+        self.assertEqual(forum.get_idea_count(), 6)
+        self.assertEqual(forum.get_author_idea_count(1), 3)
+        self.assertEqual(forum.get_author_idea_count(3), 0)
+
+
+class AgoraLoadTests(AgoraBase):
+
+    def test_get_ideas_joined(self):
+        """should render a list of ideas with one statement"""
+        forum = self._Forum()
+        self.session.expunge_all()
+        statements = self._statements(
+            lambda: [repr(idea) for idea in forum.get_ideas()])
+        self.assertEqual(len(statements), 1)
+
+    def test_get_ideas_lazy(self):
+        """should load each author on first use"""
+        forum = self._Forum()
+        self.session.expunge_all()
+        statements = self._statements(
+            lambda: [repr(idea) for idea in forum.get_ideas(load='lazy')])
+        self.assertEqual(len(statements), 1 + forum.get_author_count())
+
+    def test_get_authors_selectin(self):
+        """should load the ideas of every author with one more statement"""
+        forum = self._Forum()
+        self.session.expunge_all()
+        statements = self._statements(
+            lambda: [author.ideas for author in forum.get_authors(
+                load='selectin')])
+        self.assertEqual(len(statements), 2)
+
+    def test_iter_ideas_joined(self):
+        forum = self._Forum()
+        self.session.expunge_all()
+        statements = self._statements(
+            lambda: [repr(idea) for idea in forum.iter_ideas(batch_size=2)])
+        self.assertEqual(len(statements), 1)
+
+    def test_bad_load(self):
+        forum = self._Forum()
+        with self.assertRaises(ValueError):
+            forum.get_ideas(load='eager')
+
+
+class AgoraBulkEditTests(AgoraBase):
+
+    def test_edit_ideas(self):
+        """should update loaded ideas in one statement"""
+        forum = self._Forum()
+        ideas = forum.get_ideas(filters={'author_id': 1})
+        modified = ideas[0].modified
+        statements = self._statements(
+            forum.edit_ideas, {'visible': True}, filters={'author_id': 1})
+        self.assertEqual(len(statements), 1)
+        self.assertTrue(statements[0].startswith('UPDATE ideas'))
+        self.assertEqual([idea.visible for idea in ideas], [True] * 3)
+        self.assertGreater(ideas[0].modified, modified)
+        self.session.remove()
+        self.assertEqual(
+            len(forum.get_ideas(filters={'visible': True})), 3)
+
+    def test_edit_ideas_by_ids(self):
+        forum = self._Forum()
+        forum.chunk_size = 2
+        self.assertEqual(forum.edit_ideas({'visible': True},
+                                          ids=iter([1, 2, 5, 100])), 3)
+        self.assertEqual(
+            [idea.id for idea in forum.get_ideas(
+                filters={'visible': True}, order='id')], [1, 2, 5])
+        self.assertEqual(forum.edit_ideas(
+            {'visible': False}, filters={'author_id': 1}, ids=[1, 5]), 1)
+
+    def test_edit_ideas_unevaluated(self):
+        """should fetch ids for criteria we cannot test in Python"""
+        forum = self._Forum()
+        idea = forum.get_idea(3)
+        self.assertEqual(forum.edit_ideas(
+            {'idea': 'Edited'}, filters={'title__startswith': 'Idea 3'}), 2)
+        self.assertEqual(idea.idea, 'Edited')
+
+    def test_edit_ideas_invalidates(self):
+        from cullerton.agora.cache import LRUCache
+        from cullerton.agora.search import MemoryIndex
+        forum = self._Forum()
+        forum.cache = LRUCache()
+        forum.search_index = MemoryIndex()
+        forum.rebuild_search_index()
+        self.assertEqual(forum.get_author_idea_count(1), 3)
+        forum.get_idea_dict(1)
+        forum.edit_ideas({'author_id': 2, 'title': 'Moved'}, ids=[1])
+        self.assertEqual(forum.get_idea_dict(1)['author'],
+                         str(forum.get_author(2)))
+        self.assertEqual(forum.get_author_idea_count(1), 2)
+        self.assertEqual(
+            [idea.id for idea in forum.search_ideas('moved')[0]], [1])
+
+    def test_edit_ideas_bad_values(self):
+        from cullerton.agora.exceptions import EditIdea, InvalidFilter
+        forum = self._Forum()
+        with self.assertRaises(EditIdea):
+            forum.edit_ideas({'visible': True})
+        with self.assertRaises(EditIdea):
+            forum.edit_ideas({'nothing': True}, filters={})
+        with self.assertRaises(EditIdea):
+            forum.edit_ideas({'id': 10}, filters={})
+        with self.assertRaises(InvalidFilter):
+            forum.edit_ideas({'visible': True}, filters={'nothing': 1})
+
+    def test_edit_ideas_duplicate(self):
+        """should roll back the whole edit"""
+        from cullerton.agora.exceptions import EditIdea
+        forum = self._Forum()
+        with self.assertRaises(EditIdea):
+            forum.edit_ideas({'title': 'Same'}, filters={'author_id': 1})
+        self.assertEqual(forum.get_idea(1).title, 'Idea 1')
+
+    def test_edit_authors(self):
+        forum = self._Forum()
+        self.assertEqual(forum.edit_authors({'active': True}, filters={}), 2)
+        self.assertEqual(
+            len(forum.get_authors(filters={'active': True})), 2)
+        self.assertEqual(forum.edit_authors(
+            {'fullname': 'Someone'}, ids=[2]), 1)
+        self.assertEqual(forum.get_author(2).fullname, 'Someone')
+
+
+class AgoraChangesTests(AgoraBase):
+
+    def _Forum(self):
+        forum = super(AgoraChangesTests, self)._Forum()
+        # read changes as soon as they are made
+        forum.changes_lag = 0
+        return forum
+
+    def _changes(self, forum, token=None, limit=None):
+        """return all the changes after token, read limit at a time,
+           as (action, id), and the token after them"""
+        changes = []
+        while True:
+            (page, token) = forum.changes_since(token, limit=limit)
+            if not page:
+                return (changes, token)
+            changes.extend((action, id) for (action, id, record) in page)
+
+    def test_timestamps(self):
+        """should stamp each row when it is added and edited"""
+        forum = self._Forum()
+        ideas = forum.get_ideas(order='id')
+        self.assertEqual(len(set(idea.created for idea in ideas)), 6)
+        self.assertEqual(sorted(ideas, key=lambda idea: idea.created), ideas)
+        modified = ideas[0].modified
+        forum.edit_idea(1, idea='Edited')
+        self.assertGreater(forum.get_idea(1).modified, modified)
+        self.assertEqual(forum.get_idea(1).created, ideas[0].created)
+
+    def test_changes_since(self):
+        forum = self._Forum()
+        (page, token) = forum.changes_since(limit=2)
+        self.assertEqual([(action, id) for (action, id, record) in page],
+                         [('upsert', 1), ('upsert', 2)])
+        self.assertEqual(page[0][2], forum.get_idea_records(
+            filters={'id': 1})[0])
+        (changes, token) = self._changes(forum, token, limit=2)
+        self.assertEqual(changes, [('upsert', id) for id in range(3, 7)])
+        self.assertEqual(forum.changes_since(token), ([], token))
+
+        forum.edit_idea(2, title='Edited')
+        forum.delete_idea(3)
+        forum.delete_author(2)
+        forum.edit_ideas({'visible': True}, ids=[1])
+        (changes, token) = self._changes(forum, token, limit=2)
+        self.assertEqual(changes, [
+            ('upsert', 2), ('delete', 3), ('delete', 4), ('delete', 5),
+            ('delete', 6), ('upsert', 1)])
+        self.assertEqual(forum.changes_since(token), ([], token))
+
+    def test_changes_since_start(self):
+        """should read tombstones from the start"""
+        forum = self._Forum()
+        forum.delete_idea(1)
+        self.assertEqual(self._changes(forum)[0],
+                         [('upsert', id) for id in range(2, 7)] +
+                         [('delete', 1)])
+
+    def test_changes_since_lag(self):
+        from cullerton.agora import Forum
+        forum = self._Forum()
+        self.assertEqual(forum.changes_since(lag=60)[0], [])
+        self.assertEqual(Forum(self.session).changes_since()[0], [])
+
+    def test_changes_since_server_default(self):
+        """rows stamped by the database should be in the feed"""
+        from sqlalchemy import text
+        forum = self._Forum()
+        token = forum.changes_since()[1]
+        self.session.execute(text(
+            "INSERT INTO ideas (title, idea, author_id) "
+            "VALUES ('Raw Idea', 'Inserted with SQL.', 1)"))
+        self.session.commit()
+        self.assertEqual(self._changes(forum, token)[0], [('upsert', 7)])
+
+    def test_changes_since_long_transaction(self):
+        """changes written early in a long transaction should be stamped
+           when it commits, not skipped by a reader that read meanwhile"""
+        from datetime import timedelta
+        from unittest import mock
+        from cullerton.agora.models import utcnow
+        forum = self._Forum()
+        token = self._changes(forum)[1]
+
+        # an import that began writing a minute ago
+        began = utcnow() - timedelta(minutes=1)
+        with forum.transaction():
+            with mock.patch('cullerton.agora.agora.utcnow',
+                            return_value=began):
+                forum.add_ideas([{'title': 'Imported', 'idea': 'Long ago.',
+                                  'author_id': 1}])
+                forum.add_idea('Added', 'Long ago.', 1)
+                forum.edit_ideas({'visible': True}, ids=[1])
+                forum.edit_idea(2, title='Edited')
+                forum.delete_idea(3)
+        self.assertEqual(sorted(self._changes(forum, token)[0]), [
+            ('delete', 3), ('upsert', 1), ('upsert', 2), ('upsert', 7),
+            ('upsert', 8)])
+        for id in (1, 2, 7, 8):
+            self.assertGreater(forum.get_idea(id).modified, began)
+
+    def test_changes_since_bad_token(self):
+        from cullerton.agora.exceptions import InvalidCursor
+        forum = self._Forum()
+        with self.assertRaises(InvalidCursor):
+            forum.changes_since('nonsense')
+
+    def test_purge_tombstones(self):
+        from cullerton.agora.models import utcnow
+        forum = self._Forum()
+        forum.delete_author_ideas(1)
+        self.assertEqual(forum.purge_tombstones(utcnow()), 3)
+        self.assertEqual(self._changes(forum)[0],
+                         [('upsert', id) for id in range(4, 7)])
+
+    def test_tombstones_roll_back(self):
+        from datetime import datetime
+        from cullerton.agora.exceptions import InvalidIdea
+        forum = self._Forum()
+        with self.assertRaises(InvalidIdea):
+            with forum.transaction():
+                forum.delete_idea(1)
+                forum.delete_idea(100)
+        self.assertEqual(forum.purge_tombstones(datetime.max), 0)
+
+
+class AgoraTransactionTests(AgoraBase):
+
+    def _commits(self, call, *args, **kwargs):
+        """return the number of commits made by call"""
+        from sqlalchemy import event
+        commits = []
+
+        def commit(conn):
+            commits.append(conn)
+
+        engine = self.session.get_bind()
+        event.listen(engine, 'commit', commit)
+        try:
+            call(*args, **kwargs)
+        finally:
+            event.remove(engine, 'commit', commit)
+        return len(commits)
+
+    def test_commit_once(self):
+        forum = self._Forum()
+
+        def add():
+            with forum.transaction():
+                author_id = forum.add_author(
+                    'user_3', 'User 3', 'user_3@example.com')
+                self.assertIsNotNone(author_id)
+                for idea in range(5):
+                    forum.add_idea('Idea %s' % idea, 'An idea', author_id)
+            return author_id
+
+        self.assertEqual(self._commits(add), 1)
+        self.session.remove()
+        self.assertEqual(forum.get_author_count(), 3)
+        self.assertEqual(forum.get_idea_count(), 11)
+
+    def test_rollback(self):
+        """should undo every call, and leave counts and the cache alone"""
+        from cullerton.agora.cache import LRUCache
+        forum = self._Forum()
+        forum.cache = LRUCache()
+        self.assertEqual(forum.get_idea_count(), 6)
+        with self.assertRaises(ValueError):
+            with forum.transaction():
+                forum.edit_idea(1, title='Edited Title')
+                self.assertEqual(forum.get_idea_dict(1)['title'],
+                                 'Edited Title')
+                forum.delete_author(2)
+                self.assertEqual(forum.get_author_idea_count(1), 3)
+                raise ValueError
+        self.assertEqual(forum.get_idea_dict(1)['title'], 'Idea 1')
+        self.assertEqual(forum.get_idea_count(), 6)
+        self.assertEqual(forum.get_author_count(), 2)
+        self.assertEqual(forum.get_author_idea_count(2), 3)
+
+    def test_forum_error(self):
+        """should roll back the call that failed, and nothing else"""
+        from cullerton.agora.exceptions import DuplicateIdea
+        forum = self._Forum()
+        with forum.transaction():
+            forum.add_idea('New Idea', 'An idea', 1)
+            with self.assertRaises(DuplicateIdea):
+                forum.add_idea('Idea 1', 'An idea', 1)
+            forum.add_idea('Newer Idea', 'An idea', 1)
+        self.session.remove()
+        self.assertEqual(forum.get_idea_count(), 8)
+        self.assertEqual(forum.get_author_idea_count(1), 5)
+
+    def test_savepoint(self):
+        forum = self._Forum()
+        with forum.transaction():
+            forum.add_idea('New Idea', 'An idea', 1)
+            with self.assertRaises(ValueError):
+                with forum.transaction():
+                    forum.add_idea('Newer Idea', 'An idea', 1)
+                    forum.delete_idea(2)
+                    raise ValueError
+            with forum.transaction():
+                forum.delete_idea(3)
+        self.session.remove()
+        self.assertEqual(forum.get_idea_count(), 6)
+        self.assertEqual(
+            [idea.title for idea in forum.get_ideas(
+                filters={'author_id': 1}, order='id')],
+            ['Idea 1', 'Idea 2', 'New Idea'])
+
+    def test_deferred_counts(self):
+        """should update counts only once the transaction commits"""
+        forum = self._Forum()
+        self.assertEqual(forum.get_idea_count(), 6)
+        with forum.transaction():
+            forum.add_idea('New Idea', 'An idea', 1)
+            self.assertEqual(forum.counts.get('ideas'), 6)
+        self.assertEqual(forum.counts.get('ideas'), 7)
+
+
+@unittest.skipUnless(_installed('aiosqlite', 'greenlet'),
+                     'needs cullerton.agora[async]')
+class AgoraAsyncTests(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        from cullerton.agora.engine import sqlite_transactions
+        from cullerton.agora.models import Base
+        from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+        from sqlalchemy.pool import StaticPool
+
+        self.engine = create_async_engine(
+            'sqlite+aiosqlite://', poolclass=StaticPool)
+        sqlite_transactions(self.engine)
+        async with self.engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        self.session = AsyncSession(self.engine, expire_on_commit=False)
+        await self.session.run_sync(_populate_test_db)
+
+    async def asyncTearDown(self):
+        await self.session.close()
+        await self.engine.dispose()
+
+    def _Forum(self):
+        from cullerton.agora.aio import AsyncForum
+        return AsyncForum(self.session)
+
+    async def test_validate(self):
+        await self._Forum().validate()
+
+    async def test_get_ideas(self):
+        forum = self._Forum()
+        ideas = await forum.get_ideas()
+        self.assertEqual(len(ideas), await forum.get_idea_count())
+        # authors are loaded with the ideas
+        self.assertIn('User 1', repr(ideas[0]))
+
+    async def test_iter_ideas(self):
+        forum = self._Forum()
+        ideas = [idea.id async for idea in forum.iter_ideas(batch_size=4)]
+        self.assertEqual(ideas, list(range(1, 7)))
+        ideas = [idea.id async for idea in forum.iter_ideas(
+            limit=3, order='-id', batch_size=2)]
+        self.assertEqual(ideas, [6, 5, 4])
+
+    async def test_add_and_delete(self):
+        from cullerton.agora.exceptions import DuplicateIdea, InvalidAuthor
+        forum = self._Forum()
+
+        id = await forum.add_idea('Async Idea', 'This is async.', 1)
+        self.assertEqual((await forum.get_idea(id)).title, 'Async Idea')
+        with self.assertRaises(DuplicateIdea):
+            await forum.add_idea('Async Idea', 'Again', 1)
+
+        self.assertEqual(await forum.delete_author(1), 1)
+        self.assertIsNone(await forum.get_author(1))
+        self.assertEqual(await forum.get_idea_count(), 3)
+        with self.assertRaises(InvalidAuthor):
+            await forum.delete_author(1)
+
+    async def test_transaction(self):
+        forum = self._Forum()
+        with self.assertRaises(ValueError):
+            async with forum.transaction():
+                await forum.add_idea('Async Idea', 'This is async.', 1)
+                raise ValueError
+        self.assertEqual(len(await forum.get_ideas()), 6)
+
+        async with forum.transaction():
+            author_id = await forum.add_author(
+                'user_3', 'User 3', 'user_3@example.com')
+            await forum.add_idea('Async Idea', 'This is async.', author_id)
+        self.assertEqual(await forum.get_author_idea_count(author_id), 1)
+
+    async def test_changes_since(self):
+        forum = self._Forum()
+        (changes, token) = await forum.changes_since(lag=0)
+        self.assertEqual(len(changes), 6)
+        await forum.delete_idea(1)
+        (changes, token) = await forum.changes_since(token, lag=0)
+        self.assertEqual(changes, [('delete', 1, None)])
+
+
+class AgoraSearchTests(AgoraBase):
+
+    def _Forum(self):
+        from cullerton.agora import Forum
+        from cullerton.agora.search import FTS5Index
+        index = FTS5Index()
+        index.create(self.session)
+        return Forum(self.session, search_index=index)
+
+    def _titles(self, forum, query, **kwargs):
+        (ideas, cursor) = forum.search_ideas(query, **kwargs)
+        return [(idea.title, idea.author_id) for idea in ideas]
+
+    def test_search_ideas(self):
+        """should match every word, best match first"""
+        forum = self._Forum()
+        forum.add_idea('Gardens', 'Idea gardens grow ideas.', 1)
+        forum.add_idea('Patch', 'A garden of idea number 2.', 2)
+
+        self.assertEqual(
+            self._titles(forum, 'number 2'), [('Idea 2', 1), ('Idea 2', 2),
+                                              ('Patch', 2)])
+        self.assertEqual(self._titles(forum, 'gardens'), [('Gardens', 1)])
+        self.assertEqual(self._titles(forum, 'gardens tulips'), [])
+        self.assertEqual(self._titles(forum, '"*" OR'), [])
+
+    def test_search_ideas_cursor(self):
+        forum = self._Forum()
+        (ideas, cursor) = forum.search_ideas('idea', limit=4)
+        self.assertEqual(len(ideas), 4)
+        (more, cursor) = forum.search_ideas('idea', limit=4, cursor=cursor)
+        self.assertEqual(len(more), 2)
+        self.assertIsNone(cursor)
+        self.assertFalse(set(ideas) & set(more))
+
+    def test_search_follows_writes(self):
+        forum = self._Forum()
+        id = forum.add_idea('Tulips', 'Tulips are flowers.', 1)
+        self.assertEqual(self._titles(forum, 'tulips'), [('Tulips', 1)])
+
+        forum.edit_idea(id, idea='Roses are flowers.')
+        self.assertEqual(self._titles(forum, 'roses'), [('Tulips', 1)])
+        self.assertEqual(self._titles(forum, 'are'), [('Tulips', 1)])
+
+        forum.add_ideas([{'title': 'Daisies', 'idea': 'Daisies are flowers.',
+                          'author_id': 2}])
+        self.assertEqual(len(self._titles(forum, 'flowers')), 2)
+
+        forum.delete_idea(id)
+        self.assertEqual(self._titles(forum, 'flowers'), [('Daisies', 2)])
+
+        forum.delete_author(2)
+        self.assertEqual(self._titles(forum, 'flowers'), [])
+        self.assertEqual(self._titles(forum, 'idea'),
+                         [('Idea 1', 1), ('Idea 2', 1), ('Idea 3', 1)])
+
+    def test_rebuild_search_index(self):
+        from cullerton.agora.models import Idea
+        forum = self._Forum()
+        self.session.query(Idea).delete()
+        self.session.commit()
+        forum.rebuild_search_index()
+        self.assertEqual(self._titles(forum, 'idea'), [])
+
+    def test_no_search_index(self):
+        from cullerton.agora import Forum
+        from cullerton.agora.exceptions import InvalidSearch
+        forum = Forum(self.session)
+        with self.assertRaises(InvalidSearch):
+            forum.search_ideas('idea')
+
+
+class AgoraMemorySearchTests(AgoraSearchTests):
+
+    def _Forum(self):
+        from cullerton.agora import Forum
+        from cullerton.agora.search import MemoryIndex
+        index = MemoryIndex()
+        index.rebuild(self.session)
+        return Forum(self.session, search_index=index)
+
+    def test_create_index(self):
+        from cullerton.agora.search import create_index, FTS5Index
+        self.assertIsInstance(create_index(self.session), FTS5Index)
+
+
+class AgoraFilterTests(AgoraBase):
+
+    def _ids(self, items):
+        return [item.id for item in items]
+
+    def test_filter_operators(self):
+        forum = self._Forum()
+        self.assertEqual(
+            self._ids(forum.get_ideas(filters={'id__in': [2, 5, 9]})), [2, 5])
+        self.assertEqual(
+            self._ids(forum.get_ideas(filters={'id__notin': [1, 2, 3]})),
+            [4, 5, 6])
+        self.assertEqual(
+            self._ids(forum.get_ideas(filters={'id__gt': 2, 'id__lte': 4})),
+            [3, 4])
+        self.assertEqual(
+            self._ids(forum.get_ideas(filters={'title__startswith': 'Idea 3'})),
+            [3, 6])
+        self.assertEqual(
+            self._ids(forum.get_ideas(filters={'author_id__ne': 1})),
+            [4, 5, 6])
+        self.assertEqual(
+            self._ids(forum.get_authors(filters={'username': 'user_2'})), [2])
+
+    def test_filter_startswith_wildcards(self):
+        """should match % and _ literally"""
+        forum = self._Forum()
+        for title in ('50% off', '50 percent', 'a_b', 'axb', 'a\\c'):
+            forum.add_idea(title, 'text', 1)
+        for (prefix, titles) in (('50%', ['50% off']),
+                                 ('a_', ['a_b']),
+                                 ('a\\', ['a\\c']),
+                                 ('%', []), ('_', [])):
+            ideas = forum.get_ideas(filters={'title__startswith': prefix})
+            self.assertEqual([idea.title for idea in ideas], titles)
+
+    def test_filter_and_order(self):
+        """ideas by some authors, created recently, visible, newest first"""
+        from datetime import datetime, timedelta
+        forum = self._Forum()
+        forum.edit_idea(2, visible=True)
+        forum.edit_idea(5, visible=True)
+        filters = {'author_id__in': [1, 2],
+                   'created__gte': datetime.now() - timedelta(days=7),
+                   'visible': True}
+
+        statements = self._statements(
+            forum.get_ideas, filters=filters, order=['-created', '-id'])
+        self.assertEqual(len(statements), 1)
+        self.assertEqual(
+            self._ids(forum.get_ideas(filters=filters,
+                                      order=['-created', '-id'])), [5, 2])
+        self.assertEqual(
+            self._ids(forum.get_ideas(order=['-author_id', 'title'])),
+            [4, 5, 6, 1, 2, 3])
+
+    def test_filter_count_and_page(self):
+        forum = self._Forum()
+        filters = {'title__startswith': 'Idea 1'}
+        (ideas, cursor) = forum.get_ideas_page(filters=filters, limit=1)
+        self.assertEqual(self._ids(ideas), [1])
+        (ideas, cursor) = forum.get_ideas_page(
+            filters=filters, limit=1, cursor=cursor)
+        self.assertEqual(self._ids(ideas), [4])
+        self.assertEqual(
+            len(list(forum.iter_ideas(filters={'id__lt': 4}))), 3)
+
+    def test_bad_filter(self):
+        from cullerton.agora.exceptions import InvalidFilter
+        forum = self._Forum()
+        for filters in ({'id__near': 1}, {'nothing': 1}, {'to_dict': 1}):
+            with self.assertRaises(InvalidFilter):
+                forum.get_ideas(filters=filters)
+        with self.assertRaises(InvalidFilter):
+            forum.get_ideas(order='-nothing')
+
+
+class AgoraBatchTests(AgoraBase):
+
+    def test_get_ideas_by_ids(self):
+        """should return ideas in input order, None for missing ids"""
+        forum = self._Forum()
+        self.session.expunge_all()
+        ids = [5, 99, 1, 5, -1, 3]
+
+        statements = self._statements(forum.get_ideas_by_ids, ids)
+        self.assertEqual(len(statements), 1)
+        ideas = forum.get_ideas_by_ids(ids)
+        self.assertEqual([idea.id if idea else None for idea in ideas],
+                         [5, None, 1, 5, None, 3])
+
+    def test_get_ideas_by_ids_identity_map(self):
+        """should not read ideas already in the session"""
+        forum = self._Forum()
+        self.session.expunge_all()
+        # the identity map only holds ideas we keep a reference to
+        ideas = forum.get_ideas(filters={'id__in': [1, 2]})
+        statements = self._statements(forum.get_ideas_by_ids, [2, 1, 3])
+        self.assertEqual(len(statements), 1)
+        self.assertEqual(self._statements(forum.get_ideas_by_ids, [2, 1]), [])
+        self.assertEqual(forum.get_ideas_by_ids([2, 1]), ideas[::-1])
+
+    def test_get_ideas_by_ids_chunks(self):
+        forum = self._Forum()
+        forum.chunk_size = 2
+        self.session.expunge_all()
+        statements = self._statements(forum.get_ideas_by_ids, range(1, 7))
+        self.assertEqual(len(statements), 3)
+
+    def test_get_authors_by_ids(self):
+        forum = self._Forum()
+        authors = forum.get_authors_by_ids([2, 3, 1])
+        self.assertEqual([author.id if author else None
+                          for author in authors], [2, None, 1])
+
+
+class AgoraRecordTests(AgoraBase):
+
+    def test_get_idea_records(self):
+        """should match the ideas without loading them"""
+        from cullerton.agora.records import IdeaRecord
+        forum = self._Forum()
+        records = forum.get_idea_records(order='id')
+        self.assertEqual(len(records), 6)
+        self.assertIsInstance(records[0], IdeaRecord)
+        self.assertEqual(len(self.session.identity_map), 0)
+        ideas = forum.get_ideas(order='id')
+        self.assertEqual([record.to_dict() for record in records],
+                         [idea.to_dict() for idea in ideas])
+        self.assertEqual(records[0].author_username,
+                         ideas[0].author.username)
+
+    def test_get_idea_records_statements(self):
+        forum = self._Forum()
+        self.assertEqual(len(self._statements(
+            lambda: [record.to_dict() for record in
+                     forum.get_idea_records()])), 1)
+
+    def test_get_idea_records_filters(self):
+        forum = self._Forum()
+        records = forum.get_idea_records(
+            filters={'author_id': 2}, limit=2, order='-id')
+        self.assertEqual([record.id for record in records], [6, 5])
+
+    def test_iter_idea_records(self):
+        forum = self._Forum()
+        self.assertEqual(list(forum.iter_idea_records(batch_size=4)),
+                         forum.get_idea_records())
+
+    def test_get_author_records(self):
+        forum = self._Forum()
+        records = forum.get_author_records(order='id')
+        self.assertEqual([record.to_dict() for record in records],
+                         [author.to_dict() for author in
+                          forum.get_authors(order='id')])
+        self.assertEqual(list(forum.iter_author_records()), records)
+
+    def test_read_only(self):
+        forum = self._Forum()
+        record = forum.get_author_records(limit=1)[0]
+        with self.assertRaises(AttributeError):
+            record.username = 'other'
+        with self.assertRaises(AttributeError):
+            record.other = 'other'
+
+
+class AgoraExportTests(AgoraBase):
+
+    def test_export_ideas_jsonl(self):
+        import io
+        import json
+        forum = self._Forum()
+        file = io.StringIO()
+        self.assertEqual(forum.export_ideas(file), 6)
+        rows = [json.loads(line) for line in file.getvalue().splitlines()]
+        self.assertEqual([row['id'] for row in rows], list(range(1, 7)))
+        self.assertEqual(rows[0]['title'], 'Idea 1')
+        self.assertEqual(rows[0]['author_username'], 'user_1')
+        self.assertEqual(rows[0]['created'],
+                         forum.get_idea(1).created.isoformat())
+
+    def test_export_authors_csv(self):
+        import csv
+        import io
+        forum = self._Forum()
+        file = io.StringIO()
+        self.assertEqual(forum.export_authors(
+            file, format='csv', filters={'id': 2}), 1)
+        rows = list(csv.DictReader(io.StringIO(file.getvalue())))
+        self.assertEqual(rows[0]['username'], 'user_2')
+        self.assertEqual(rows[0]['active'], 'False')
+
+    def test_export_statements(self):
+        """should stream from one query, without loading items"""
+        import io
+        forum = self._Forum()
+        self.assertEqual(len(self._statements(
+            forum.export_ideas, io.StringIO(), batch_size=2)), 1)
+        self.assertEqual(len(self.session.identity_map), 0)
+
+    def test_export_bad_format(self):
+        import io
+        forum = self._Forum()
+        with self.assertRaises(ValueError):
+            forum.export_ideas(io.StringIO(), format='xml')
+
+    def test_main(self):
+        import gzip
+        import json
+        import os
+        import tempfile
+        from contextlib import redirect_stderr
+        from io import StringIO
+        from cullerton.agora.engine import create_agora_engine
+        from cullerton.agora.export import main
+        from cullerton.agora.models import Base
+        from sqlalchemy.orm import Session
+
+        with tempfile.TemporaryDirectory() as directory:
+            url = 'sqlite:///%s' % os.path.join(directory, 'agora.sqlite')
+            engine = create_agora_engine(url)
+            Base.metadata.create_all(engine)
+            session = Session(bind=engine)
+            _populate_test_db(session)
+            session.close()
+            engine.dispose()
+
+            output = os.path.join(directory, 'ideas.jsonl.gz')
+            with redirect_stderr(StringIO()):
+                main(['export_agora', url, 'ideas', output,
+                      '--filter', 'author_id=2', '--order=-id'])
+            with gzip.open(output, 'rt') as f:
+                rows = [json.loads(line) for line in f]
+        self.assertEqual([row['id'] for row in rows], [6, 5, 4])
+
+
+class AgoraMetricsTests(AgoraBase):
+
+    def _Forum(self, **kwargs):
+        from cullerton.agora import Forum
+        from cullerton.agora.metrics import Metrics
+        return Forum(self.session, metrics=Metrics(**kwargs))
+
+    def test_method_counts(self):
+        forum = self._Forum()
+        forum.get_idea(1)
+        forum.get_idea(2)
+        forum.get_ideas(limit=2)
+        methods = forum.metrics.snapshot()['methods']
+        self.assertEqual(methods['get_idea']['calls'], 2)
+        self.assertEqual(methods['get_idea']['statements'], 2)
+        self.assertEqual(methods['get_idea']['seconds']['count'], 2)
+        self.assertEqual(methods['get_ideas']['statements'], 1)
+        self.assertNotIn('get_author', methods)
+
+    def test_nested_calls(self):
+        """should count statements against the outer method only"""
+        forum = self._Forum()
+        forum.delete_author(1)
+        methods = forum.metrics.snapshot()['methods']
+        self.assertEqual(list(methods), ['delete_author'])
+        self.assertGreater(methods['delete_author']['statements'], 1)
+
+    def test_iterator(self):
+        forum = self._Forum()
+        ideas = list(forum.iter_ideas(batch_size=2))
+        self.assertEqual(len(ideas), 6)
+        methods = forum.metrics.snapshot()['methods']
+        self.assertEqual(methods['iter_ideas']['calls'], 1)
+        self.assertEqual(methods['iter_ideas']['statements'], 1)
+
+    def test_errors(self):
+        from cullerton.agora.exceptions import InvalidIdea
+        forum = self._Forum()
+        with self.assertRaises(InvalidIdea):
+            forum.delete_idea(100)
+        self.assertEqual(
+            forum.metrics.snapshot()['methods']['delete_idea']['errors'], 1)
+
+    def test_slow_query_log(self):
+        forum = self._Forum(slow_query=0)
+        with self.assertLogs('cullerton.agora.logging', 'WARNING') as logs:
+            forum.get_idea(1)
+        self.assertIn('slow query', logs.output[0])
+        self.assertIn('get_idea', logs.output[0])
+        self.assertEqual(forum.metrics.snapshot()['slow_queries'], 1)
+
+    def test_prometheus(self):
+        forum = self._Forum()
+        forum.get_idea(1)
+        text = forum.metrics.prometheus()
+        self.assertIn('# TYPE agora_forum_calls_total counter', text)
+        self.assertIn('agora_forum_calls_total{method="get_idea"} 1', text)
+        self.assertIn('agora_forum_call_seconds_bucket'
+                      '{method="get_idea",le="+Inf"} 1', text)
+        self.assertIn('agora_statement_seconds_count 1', text)
+
+    def test_reset(self):
+        forum = self._Forum()
+        forum.get_idea(1)
+        forum.metrics.reset()
+        self.assertEqual(forum.metrics.snapshot()['methods'], {})
+
+
+class AgoraEngineTests(unittest.TestCase):
+
+    def setUp(self):
+        import tempfile
+        self.directory = tempfile.TemporaryDirectory()
+        self.url = 'sqlite:///%s/agora.sqlite' % self.directory.name
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_engine_config(self):
+        from cullerton.agora.engine import engine_config, default_url
+        self.assertEqual(engine_config({}), (default_url, {}))
+        environ = {'AGORA_DATABASE_URL': self.url,
+                   'AGORA_POOL_SIZE': '3',
+                   'AGORA_MAX_OVERFLOW': '0',
+                   'AGORA_POOL_RECYCLE': '600',
+                   'AGORA_POOL_PRE_PING': 'true'}
+        self.assertEqual(engine_config(environ), (self.url, {
+            'pool_size': 3, 'max_overflow': 0, 'pool_recycle': 600,
+            'pool_pre_ping': True}))
+
+    def test_replica_config(self):
+        from cullerton.agora.engine import replica_config
+        self.assertEqual(replica_config({}), ([], 'round_robin'))
+        environ = {
+            'AGORA_REPLICA_URLS': 'sqlite:///a.sqlite, sqlite:///b.sqlite',
+            'AGORA_REPLICA_STRATEGY': 'least_connections'}
+        self.assertEqual(replica_config(environ), (
+            ['sqlite:///a.sqlite', 'sqlite:///b.sqlite'], 'least_connections'))
+
+    def test_create_agora_engine(self):
+        """should apply the pool options and the SQLite pragmas"""
+        from cullerton.agora.engine import create_agora_engine, pool_stats
+        environ = {'AGORA_DATABASE_URL': self.url, 'AGORA_POOL_SIZE': '2'}
+        engine = create_agora_engine(environ=environ)
+        self.assertEqual(engine.pool.size(), 2)
+
+        with engine.connect() as conn:
+            self.assertEqual(
+                conn.exec_driver_sql('PRAGMA journal_mode').scalar(), 'wal')
+            self.assertEqual(
+                conn.exec_driver_sql('PRAGMA synchronous').scalar(), 1)
+            self.assertEqual(
+                conn.exec_driver_sql('PRAGMA foreign_keys').scalar(), 1)
+            self.assertEqual(pool_stats(engine)['checked_out'], 1)
+
+        stats = pool_stats(engine)
+        self.assertEqual(stats['connects'], 1)
+        self.assertEqual(stats['checkouts'], 1)
+        self.assertEqual(stats['checked_out'], 0)
+        self.assertEqual(stats['peak_checked_out'], 1)
+        engine.dispose()
+
+    def test_lazy_session(self):
+        """should bind to the configured engine on first use"""
+        from cullerton.agora import engine
+        from cullerton.agora.session import DBSession
+        self.addCleanup(setattr, engine, '_engine', engine._engine)
+        engine._engine = None
+
+        configured = engine.configure_engine(self.url)
+        self.assertIs(DBSession().get_bind(), configured)
+        DBSession.remove()
+        configured.dispose()
+
+    def test_session_per_thread(self):
+        """a Forum of a sessionmaker should use a session for each thread"""
+        import threading
+        from sqlalchemy.orm import sessionmaker
+        from cullerton.agora.engine import create_agora_engine
+        from cullerton.agora import Forum
+        from cullerton.agora.models import Base
+        engine = create_agora_engine(self.url)
+        Base.metadata.create_all(engine)
+        forum = Forum(sessionmaker(bind=engine), validate=False)
+        author_id = forum.add_author('pat', 'Pat Doe', 'pat@example.com')
+
+        sessions = []
+
+        def add(index):
+            forum.add_idea('Idea %s' % index, 'An idea.', author_id)
+            sessions.append(forum.session())
+            forum.session.remove()
+
+        threads = [threading.Thread(target=add, args=(index,))
+                   for index in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(set(map(id, sessions))), 4)
+        self.assertEqual(forum.get_idea_count(), 4)
+        forum.session.remove()
+        engine.dispose()
+
+    def test_write_after_read(self):
+        """a write after a read in the same session should wait for
+           other writers, not fail as the database is locked"""
+        from sqlalchemy.orm import Session
+        from cullerton.agora import Forum
+        from cullerton.agora.engine import create_agora_engine
+        from cullerton.agora.models import Base
+        engine = create_agora_engine(self.url)
+        Base.metadata.create_all(engine)
+        first = Forum(Session(bind=engine), validate=False)
+        second = Forum(Session(bind=engine), validate=False)
+        author_id = first.add_author('pat', 'Pat Doe', 'pat@example.com')
+
+        first.get_ideas()
+        second.add_idea('Second Idea', 'An idea.', author_id)
+        first.add_idea('First Idea', 'An idea.', author_id)
+        self.assertEqual(len(second.get_ideas()), 2)
+        first.session.close()
+        second.session.close()
+        engine.dispose()
+
+    def test_after_fork(self):
+        """a forked child should get fresh connections and pool stats"""
+        import multiprocessing
+        from cullerton.agora.engine import create_agora_engine, pool_stats
+        if 'fork' not in multiprocessing.get_all_start_methods():
+            self.skipTest('no fork')
+        engine = create_agora_engine(self.url)
+        conn = engine.connect()
+        self.assertEqual(pool_stats(engine)['checked_out'], 1)
+
+        def child(queue):
+            with engine.connect() as conn:
+                value = conn.exec_driver_sql('SELECT 1').scalar()
+            queue.put((value, pool_stats(engine)['checked_out']))
+
+        context = multiprocessing.get_context('fork')
+        queue = context.Queue()
+        process = context.Process(target=child, args=(queue,))
+        process.start()
+        self.assertEqual(queue.get(timeout=10), (1, 0))
+        process.join()
+        conn.close()
+        engine.dispose()
+
+
+    def test_forum_after_fork(self):
+        """a forum made before fork should give the child new sessions"""
+        import multiprocessing
+        from sqlalchemy.orm import sessionmaker
+        from cullerton.agora import Forum
+        from cullerton.agora.engine import create_agora_engine
+        from cullerton.agora.models import Base
+        if 'fork' not in multiprocessing.get_all_start_methods():
+            self.skipTest('no fork')
+        engine = create_agora_engine(self.url)
+        Base.metadata.create_all(engine)
+        forum = Forum(sessionmaker(bind=engine), validate=False)
+        forum.get_ideas()
+        session = forum.session()
+        connection = session.connection().connection.dbapi_connection
+
+        def child(queue):
+            forum.get_ideas()
+            queue.put((forum.session() is session,
+                       forum.session().connection().connection
+                       .dbapi_connection is connection))
+
+        context = multiprocessing.get_context('fork')
+        queue = context.Queue()
+        process = context.Process(target=child, args=(queue,))
+        process.start()
+        self.assertEqual(queue.get(timeout=10), (False, False))
+        process.join()
+        forum.session.remove()
+        engine.dispose()
+
+
+class AgoraReplicaTests(unittest.TestCase):
+
+    def setUp(self):
+        """make a primary SQLite file and copy it to two replicas"""
+        import os
+        import shutil
+        import tempfile
+        from cullerton.agora.engine import create_agora_engine
+        from cullerton.agora.models import Base
+        from sqlalchemy.orm import Session
+
+        self.directory = tempfile.TemporaryDirectory()
+        path = os.path.join(self.directory.name, 'primary.sqlite')
+        engine = create_agora_engine('sqlite:///%s' % path)
+        Base.metadata.create_all(engine)
+        session = Session(bind=engine)
+        _populate_test_db(session)
+        session.close()
+        engine.dispose()
+
+        self.primary = create_agora_engine('sqlite:///%s' % path)
+        self.replicas = []
+        for name in ('replica_1', 'replica_2'):
+            replica = os.path.join(self.directory.name, name + '.sqlite')
+            shutil.copy(path, replica)
+            self.replicas.append(create_agora_engine('sqlite:///%s' % replica))
+
+    def tearDown(self):
+        self.primary.dispose()
+        for engine in self.replicas:
+            engine.dispose()
+        self.directory.cleanup()
+
+    def _Forum(self, strategy='round_robin', sticky=1.0, **kwargs):
+        from cullerton.agora import Forum
+        from cullerton.agora.engine import ReplicaSet
+        from cullerton.agora.session import RoutingSession
+        from sqlalchemy.orm import scoped_session, sessionmaker
+
+        self.session = scoped_session(sessionmaker(
+            class_=RoutingSession, bind=self.primary, sticky=sticky,
+            replicas=ReplicaSet(self.replicas, strategy=strategy)))
+        self.addCleanup(self.session.remove)
+        return Forum(self.session, **kwargs)
+
+    def _reads(self, call, *args, **kwargs):
+        """return the names of the databases call read from"""
+        import os
+        from sqlalchemy import event
+        reads = []
+
+        def before_cursor_execute(conn, cursor, statement, *args):
+            if statement.startswith('SELECT'):
+                reads.append(os.path.basename(conn.engine.url.database))
+
+        engines = [self.primary] + self.replicas
+        for engine in engines:
+            event.listen(engine, 'before_cursor_execute',
+                         before_cursor_execute)
+        try:
+            call(*args, **kwargs)
+        finally:
+            for engine in engines:
+                event.remove(engine, 'before_cursor_execute',
+                             before_cursor_execute)
+        return reads
+
+    def test_round_robin(self):
+        """should read from each replica in turn, one per transaction"""
+        forum = self._Forum()
+
+        def read():
+            forum.get_ideas()
+            forum.get_authors()
+            self.session.commit()
+
+        self.assertEqual(self._reads(read), ['replica_1.sqlite'] * 2)
+        self.assertEqual(self._reads(read), ['replica_2.sqlite'] * 2)
+        self.assertEqual(self._reads(read), ['replica_1.sqlite'] * 2)
+
+    def test_least_connections(self):
+        from sqlalchemy.orm import Session
+        forum = self._Forum(strategy='least_connections')
+        other = Session(bind=self.replicas[0])
+        other.connection()
+        self.assertEqual(self._reads(forum.get_ideas), ['replica_2.sqlite'])
+        other.close()
+
+    def test_read_your_writes(self):
+        """should read from the primary for sticky seconds after a write"""
+        forum = self._Forum()
+        id = forum.add_author('user_3', 'User 3', 'user_3@example.com')
+        self.assertEqual(self._reads(forum.get_author, id),
+                         ['primary.sqlite'])
+        self.assertEqual(forum.get_author(id).username, 'user_3')
+
+    def test_replica_lag(self):
+        """should read from a replica once sticky seconds are up"""
+        forum = self._Forum(sticky=0)
+        id = forum.add_author('user_3', 'User 3', 'user_3@example.com')
+        self.assertIsNone(forum.get_author(id))
+
+    def test_writes(self):
+        """should write, and read inside transactions, on the primary"""
+        forum = self._Forum()
+
+        def write():
+            with forum.transaction():
+                forum.add_idea('New Idea', 'An idea', 1)
+                forum.edit_ideas({'visible': True}, filters={'author_id': 1})
+
+        self.assertEqual(set(self._reads(write)), set(['primary.sqlite']))
+        self.assertEqual(forum.get_author_idea_count(1), 4)
+
+    def test_metrics(self):
+        """should count the statements run on the replicas too"""
+        from cullerton.agora.metrics import Metrics
+        forum = self._Forum(metrics=Metrics())
+        self.assertEqual(self._reads(forum.get_ideas), ['replica_1.sqlite'])
+        forum.add_author('user_3', 'User 3', 'user_3@example.com')
+        methods = forum.metrics.snapshot()['methods']
+        self.assertEqual(methods['get_ideas']['statements'], 1)
+        self.assertEqual(methods['add_author']['statements'], 1)
+
+
+class AgoraImportTests(unittest.TestCase):
+
+    def test_import_is_cheap(self):
+        """should not import SQLAlchemy or write files"""
+        from cullerton.agora.benchmarks.importtime import import_times
+        (times, files) = import_times('cullerton.agora')
+        self.assertNotIn('sqlalchemy', times)
+        self.assertEqual(files, [])
+        # importing SQLAlchemy alone takes longer than this
+        # the cullerton namespace package, and pkg_resources, are not ours
+        self.assertLess(times['cullerton.agora'] - times['cullerton'],
+                        100000)
+
+    def test_lazy_attributes(self):
+        import cullerton.agora
+        from cullerton.agora import exceptions
+        from cullerton.agora.agora import Forum
+        self.assertIs(cullerton.agora.Forum, Forum)
+        self.assertIs(cullerton.agora.exceptions, exceptions)
+        with self.assertRaises(AttributeError):
+            cullerton.agora.nothing
+
+
+class AgoraBenchmarkTests(unittest.TestCase):
+
+    def test_generate_is_seeded(self):
+        from cullerton.agora.benchmarks.data import generate
+        (authors, ideas) = generate(100, seed=1)
+        (same_authors, same_ideas) = generate(100, seed=1)
+        self.assertEqual(authors, same_authors)
+        ideas = list(ideas)
+        self.assertEqual(ideas, list(same_ideas))
+        self.assertEqual(len(authors), 5)
+        self.assertEqual([idea['id'] for idea in ideas], list(range(1, 101)))
+
+    def test_run(self):
+        from cullerton.agora.benchmarks.forum import run, scenarios
+        results = run('sqlite://', 200, seed=1)
+        self.assertEqual(results['meta']['ideas'], 200)
+        self.assertEqual(set(results['results']),
+                         set(scenarios) | set(['populate']))
+        self.assertEqual(results['results']['iter_ideas']['ops'], 200)
+
+    def test_stress(self):
+        import tempfile
+        from cullerton.agora.benchmarks.stress import operations, run
+        with tempfile.TemporaryDirectory() as directory:
+            results = run('sqlite:///%s/stress.sqlite' % directory,
+                          threads=2, processes=2, seconds=0.3, ideas=200)
+        self.assertEqual(results['meta']['processes'], 2)
+        self.assertEqual(set(results['results']), set(operations))
+        self.assertEqual(len(results['pools']), 2)
+        self.assertGreater(sum(result['ops'] for result in
+                               results['results'].values()), 0)
+
+    def test_run_metrics(self):
+        from cullerton.agora.benchmarks.forum import run
+        results = run('sqlite://', 200, seed=1, names=['get_idea'],
+                      metrics=True)
+        self.assertGreater(results['results']['get_idea']['statements'], 0)
@@ -8,12 +8,17 @@ requires = [
     'sqlalchemy',
 ]
 
+extras = {
+    'async': ['sqlalchemy[asyncio]', 'aiosqlite'],
+}
+
 setup(
     name='cullerton.agora',
     version="0.0.2",
     packages=find_packages(),
     namespace_packages=['cullerton'],
     install_requires=requires,
+    extras_require=extras,
     author='mike cullerton',
     author_email='michaelc@cullerton.com',
     description='A forum for ideas',
@@ -24,6 +29,7 @@ setup(
     entry_points="""\
     [console_scripts]
     initialize_agora_db = cullerton.agora.initialize_db:main
+    export_agora = cullerton.agora.export:main
     """,
     package_data={
         '': ['*.txt', '*.rst', '*.ipynb'],